@@ -2,11 +2,61 @@
 from config import Config
 # Models is for database structure and interaction
 from models import db, User
+# Database gives each request one reused, tuned sqlite3 connection
+import database
+from database import get_db, get_thread_db
+# Migrations apply versioned schema changes such as indexes
+import migrations
+# Pagination is for splitting long review and comment lists into pages
+from pagination import keyset_page, first_pages
+# Ratings keeps the per-movie rating aggregates up to date
+import ratings
+# Search index is a local full text index of every movie seen from TMDB
+import search_index
+# Suggest is an in-memory title index for search as you type
+from suggest import PrefixIndex
+# Ingest loads a local movie catalog from TMDB export files
+import ingest
+# Posters serves TMDB poster images from a disk cache
+from posters import PosterCache, POSTER_PATH_PATTERN, mimetype_for
+# Fragments adds a {% cache %} tag for caching rendered parts of templates
+from fragments import FragmentCacheExtension
+# Conditional lets browsers and proxies reuse pages that haven't changed (304 Not Modified)
+from conditional import page_validators, not_modified, add_validators
+# hashlib fingerprints TMDB responses so we can tell when they change
+import hashlib
+# Compression gzips or brotlis responses and serves precompressed static files
+import compression
+# Assets rewrites static file URLs to fingerprinted names that can be cached forever
+import assets
+# Recommend builds and serves "because you rated X" recommendations
+import recommend
+# Cache is for keeping TMDB responses in memory between page views
+from cache import TTLCache, SingleFlight, make_key
+# Shared cache keeps TMDB responses in a SQLite file every worker process can use
+from shared_cache import SQLiteCache
+# TMDB client keeps a pool of connections open to the TMDB API
+from tmdb import TMDBClient
+# Breaker stops calling TMDB for a while when it is failing or slow, so pages fail fast instead of piling up
+from breaker import CircuitBreaker
+# Rate limiter keeps calls under TMDB's quota, serving trending refreshes and pages before searches
+from ratelimit import PriorityRateLimiter
+# Refresher keeps the trending list up to date in a background thread
+from refresher import BackgroundRefresher
 # Flask is for building the web application
-from flask import Flask , render_template, request, redirect, url_for, flash, jsonify, session, g
+from flask import Flask , render_template, request, redirect, url_for, flash, jsonify, session, g, send_file, abort, make_response
 # For catching database errors
 import sqlite3
-import os, time, random, requests
+import os, time, random, requests, json
+# Reads the query of the search page a request came from
+from urllib.parse import urlparse, parse_qs
+# Lock for the table of search page prefetches
+import threading
+# Thread pool for fetching several movies from TMDB at the same time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+# Lets the async serving mode (asgi.py) tell a view it already waited on TMDB
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 
@@ -23,6 +73,94 @@ load_dotenv()
 TMDB_API= os.environ.get("TMDB_API")
 # Connect the database to the app
 db.init_app(app)
+# Close the raw sqlite3 connection at the end of every request
+database.init_app(app)
+# Adds the "flask migrate" command
+app.cli.add_command(migrations.migrate_command)
+# Adds the "flask rebuild-ratings" command
+app.cli.add_command(ratings.rebuild_ratings_command)
+# Adds the "flask ingest-catalog" command
+app.cli.add_command(ingest.ingest_catalog_command)
+# Compress responses on the way out and add the "flask compress-static" command
+compression.init_app(app)
+app.cli.add_command(compression.compress_static_command)
+# Fingerprinted static URLs and the "flask build-assets" command
+assets.init_app(app)
+app.cli.add_command(assets.build_assets_command)
+# Adds the "flask build-recommendations" command
+app.cli.add_command(recommend.build_recommendations_command)
+# Shared cache for TMDB responses so popular pages don't call the API on every view
+# Either in this process's memory or in a SQLite file shared by every worker process on the machine
+if app.config["TMDB_CACHE_BACKEND"] == "sqlite":
+    tmdb_cache = SQLiteCache(
+        app.config["SHARED_CACHE_PATH"],
+        max_entries=app.config["TMDB_CACHE_MAX_ENTRIES"],
+        max_bytes=app.config["TMDB_CACHE_MAX_BYTES"],
+        busy_timeout=app.config["SQLITE_BUSY_TIMEOUT"],
+    )
+else:
+    tmdb_cache = TTLCache(
+        max_entries=app.config["TMDB_CACHE_MAX_ENTRIES"],
+        max_bytes=app.config["TMDB_CACHE_MAX_BYTES"],
+    )
+# Rendered template fragments such as the trending carousel - used by {% cache %} in the templates
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = TTLCache(
+    max_entries=app.config["FRAGMENT_CACHE_MAX_ENTRIES"],
+    max_bytes=app.config["FRAGMENT_CACHE_MAX_BYTES"],
+    default_ttl=app.config["FRAGMENT_CACHE_TTL"],
+)
+# Makes sure only one request at a time fetches the same TMDB resource
+tmdb_flight = SingleFlight()
+# Circuit breakers for the TMDB API and the poster image server, set up from the config
+def make_breaker(name):
+    return CircuitBreaker(
+        name,
+        window=app.config["TMDB_BREAKER_WINDOW"],
+        min_calls=app.config["TMDB_BREAKER_MIN_CALLS"],
+        failure_rate=app.config["TMDB_BREAKER_FAILURE_RATE"],
+        slow_call_seconds=app.config["TMDB_BREAKER_SLOW_CALL"],
+        slow_rate=app.config["TMDB_BREAKER_SLOW_RATE"],
+        open_seconds=app.config["TMDB_BREAKER_OPEN_SECONDS"],
+        half_open_calls=app.config["TMDB_BREAKER_HALF_OPEN_CALLS"],
+    )
+
+tmdb_breaker = make_breaker("tmdb")
+image_breaker = make_breaker("tmdb-images")
+# Shared by every thread in the process - poster images aren't part of the API quota so they skip it
+tmdb_limiter = PriorityRateLimiter(
+    rate=app.config["TMDB_RATE_LIMIT"],
+    burst=app.config["TMDB_RATE_BURST"],
+    max_wait=app.config["TMDB_RATE_MAX_WAIT"],
+    reserve=app.config["TMDB_RATE_RESERVE"],
+)
+# One pooled client shared by every route that talks to TMDB
+tmdb_client = TMDBClient(
+    TMDB_API,
+    pool_size=app.config["TMDB_POOL_SIZE"],
+    connect_timeout=app.config["TMDB_CONNECT_TIMEOUT"],
+    read_timeout=app.config["TMDB_READ_TIMEOUT"],
+    max_retries=app.config["TMDB_MAX_RETRIES"],
+    backoff_factor=app.config["TMDB_RETRY_BACKOFF"],
+    breaker=tmdb_breaker,
+    image_breaker=image_breaker,
+    limiter=tmdb_limiter,
+)
+# Bounded pool of threads for fetching movies that aren't cached - never more TMDB calls at once than this
+fetch_pool = ThreadPoolExecutor(max_workers=app.config["TMDB_FETCH_WORKERS"], thread_name_prefix="tmdb-fetch")
+# Separate small pool for prefetching search results, so prefetches never hold up the fetches pages wait on
+# search_prefetch_slots caps the prefetches running or queued for the whole process - past that they are skipped
+prefetch_pool = ThreadPoolExecutor(max_workers=app.config["SEARCH_PREFETCH_WORKERS"], thread_name_prefix="search-prefetch")
+search_prefetch_slots = threading.BoundedSemaphore(app.config["SEARCH_PREFETCH_MAX"])
+# Titles of every movie in the local catalog, for search as you type - loaded on first use
+suggest_index = PrefixIndex(
+    top_size=app.config["SUGGEST_LIMIT"],
+    refresh_interval=app.config["SUGGEST_REFRESH_INTERVAL"],
+)
+# How the async serving mode's TMDB fetch for this request went - None under plain WSGI
+# "ok" means the data is in the cache, "not_found" that TMDB doesn't know it and "failed" that TMDB
+# didn't answer in time, so the view must not tie up a thread waiting on TMDB a second time
+tmdb_prefetch = ContextVar("tmdb_prefetch", default=None)
 
 
 #### ROUTES ####
@@ -30,7 +168,17 @@ db.init_app(app)
 @app.route('/')
 def index():
     movie_list = get_movies()
-    return render_template('index.html', movies = movie_list)
+    # The page only changes when the trending list does - without a list yet the page must not be reused
+    validators = None
+    if trending_refresher.version is not None:
+        validators = page_validators("index", trending_refresher.version, last_modified=trending_refresher.last_changed)
+    max_age = app.config["PAGE_CACHE_MAX_AGE"]
+    cached = not_modified(validators, max_age)
+    if cached is not None:
+        return cached
+    # The carousel fragment is rebuilt whenever the trending list is refreshed
+    response = make_response(render_template('index.html', movies = movie_list, trending_version=trending_refresher.version))
+    return add_validators(response, validators, max_age)
     
 
 # User registration page - lets users create a new account
@@ -48,7 +196,7 @@ def register():
             flash("Please submit all fields")
             return redirect(url_for("register"))
         # SQL Injection vulnerability here - user input is directly inserted into SQL query
-        conn = sqlite3.connect('instance/cinefiles.db')
+        conn = get_db()
         cursor = conn.cursor()
         query = f"INSERT INTO user (username, email, password) VALUES ('{username}', '{email}', '{password}')"
         try:
@@ -73,7 +221,7 @@ def login():
         if not email or not password:
             flash("Please enter both email and password")
             return redirect(url_for('login'))
-        conn = sqlite3.connect('instance/cinefiles.db')
+        conn = get_db()
         cursor = conn.cursor()
         # Injected SQL statements will execute here - Modified for full authentication bypass vulnerability
         query = f"SELECT * FROM user WHERE email = '{email}' AND password = '{password}'"
@@ -81,7 +229,6 @@ def login():
             cursor.execute(query)
             # Fetch result - If row returned, login succeeds (allows bypass via injection)
             result = cursor.fetchone()
-            conn.close()
             if result:
                 # Store user ID in session to keep user logged in
                 # I should use session.regenerate() here to prevent session fixation attacks
@@ -107,14 +254,17 @@ def profile():
     if not user_id:
         flash("Please log in to view your profile.")
         return redirect(url_for('login'))
-    conn = sqlite3.connect('instance/cinefiles.db')
+    conn = get_db()
     cursor = conn.cursor()
     query = f"SELECT username, email, bio, location FROM user WHERE id = {user_id}"
     cursor.execute(query)
     user = cursor.fetchone()
-    conn.close()
     if user:
-        return render_template('Profile.html', username=user[0], email=user[1], bio=user[2], location=user[3], movies=get_movies())
+        # Personal recommendations from the precomputed index - trending movies if there are none yet
+        recommendations = recommend.recommendations_for_user(conn, user_id, limit=app.config["RECOMMENDATIONS_PER_PAGE"])
+        movies = [] if recommendations else get_movies()
+        return render_template('Profile.html', username=user[0], email=user[1], bio=user[2], location=user[3], movies=movies,
+                               recommendations=recommendations, trending_version=trending_refresher.version)
     else:
         flash("User not found.")
         return redirect(url_for('login'))
@@ -132,7 +282,7 @@ def edit_profile():
         bio = request.form.get('bio', "")
         location = request.form.get('location', "")
         # Update the user's profile with unsanitised input - Vulnerable to SQL Injection
-        conn = sqlite3.connect('instance/cinefiles.db')
+        conn = get_db()
         cursor = conn.cursor()
         query = f"UPDATE user SET bio = '{bio}', location = '{location}' WHERE id = {user_id}"
         try:
@@ -141,17 +291,14 @@ def edit_profile():
             flash("Profile updated successfully!")
         except sqlite3.Error as e:
             flash(f"An error occurred: {e}")
-        finally:
-            conn.close()
         return redirect(url_for('profile'))
     
 # GET request - show profile wth the updated information 
-    conn = sqlite3.connect('instance/cinefiles.db')
+    conn = get_db()
     cursor = conn.cursor()
     query = f"SELECT username, email, bio, location FROM user WHERE id = {user_id}"
     cursor.execute(query)
     user = cursor.fetchone()
-    conn.close()
     if user:
         return render_template('edit_profile.html', username=user[0], email=user[1], bio=user[2], location=user[3])
     else:
@@ -169,41 +316,255 @@ def logout():
     return redirect(url_for('index'))
 
 # Search route - allows users to search for movies
+# page picks a page of results - local pages come from the FTS index, and pages of TMDB results
+# (source=tmdb, or when the index has nothing) from TMDB, with the next page prefetched in the background
 @app.route('/search')
 def search():
     # Get the search query from the URL parameters - Vulnerable to XSS attacks
     query = request.args.get('query', '')
-    # Build a simple HTML response to show the search query - Vulnerable to XSS attacks
-    url = f"https://api.themoviedb.org/3/search/movie"
-    response = requests.get(url, params={"api_key": TMDB_API, "query": query})
-    # Check for request errors
-    response.raise_for_status()
-    # Get the JSON data from the response
-    data = response.json()
-    # Render the search results template with the movies found
-    return render_template('search.html', movies=data["results"], query=query)
+    # source=tmdb asks TMDB even when the local index already has matches
+    use_tmdb = request.args.get('source') == 'tmdb'
+    page = min(max(request.args.get('page', 1, type=int), 1), app.config["SEARCH_MAX_PAGES"])
+    per_page = app.config["SEARCH_LOCAL_LIMIT"]
+    movies, has_next, total_pages = [], False, None
+    # Searching for something else from a results page means its next page won't be read - stop its
+    # prefetch before it uses quota
+    previous = previous_search()
+    if previous is not None and previous[0] != query:
+        cancel_search_prefetch(*previous)
+    # Later pages of TMDB results only need TMDB
+    if not use_tmdb or page == 1:
+        # Try the local full text index first - it knows every movie we have already fetched
+        # One extra result tells us if there is a next page
+        movies = search_index.search(get_db(), query, limit=per_page + 1, offset=(page - 1) * per_page)
+        has_next = len(movies) > per_page
+        movies = movies[:per_page]
+    # Links to later pages of TMDB results carry source=tmdb, so only a first page falls back to TMDB
+    tmdb_pages = use_tmdb or (page == 1 and not movies)
+    next_page = None
+    if tmdb_pages:
+        try:
+            if tmdb_prefetch.get() == "failed":
+                raise requests.ConnectionError("TMDB search already failed in the async fetch")
+            data = tmdb_fetch("search", *search_request(query, page))
+            # The local matches go first on the first page
+            movies = search_index.merge_results(movies, data["results"]) if page == 1 else data["results"]
+            total_pages = min(data.get("total_pages") or 1, app.config["SEARCH_MAX_PAGES"])
+            has_next = page < total_pages
+            if has_next:
+                next_page = search_request(query, page + 1)[1]
+        except requests.RequestException:
+            # Show whatever the local index found instead of an error page
+            flash("Movie search is having problems right now, showing saved results only.")
+            has_next = False
+    if next_page is not None:
+        prefetch_search(next_page)
+    # Render the search results template with the movies found - Vulnerable to XSS attacks
+    return render_template('search.html', movies=movies, query=query, searched_tmdb=use_tmdb,
+                           page=page, has_next=has_next, total_pages=total_pages, tmdb_pages=tmdb_pages)
 
-# function to get movies from the TMDB API and display them on the homepage 
-def get_movies(count = 10, image_size = "w500"):
-        # Fetch trending movies from TMDB API
-        url = "https://api.themoviedb.org/3/trending/movie/day"
-        response = requests.get(url, params={"api_key": TMDB_API})
-        # Check for request errors
-        response.raise_for_status()
-        # Get the JSON data from the response
+# TMDB endpoint and parameters for a page of search results
+# The first page leaves page out, so it is cached under the same key as searches from before there were pages
+def search_request(query, page=1):
+    params = {"query": query}
+    if page > 1:
+        params["page"] = page
+    return "/search/movie", params
+
+# (query, page) of the search results page this request came from, or None
+# Read from the Referer, so it is per browser without a cookie - a cookie would stop search pages
+# being cached by proxies, and an address is shared by everyone behind the same proxy or NAT
+def previous_search():
+    if not request.referrer:
+        return None
+    referrer = urlparse(request.referrer)
+    if referrer.path != url_for('search'):
+        return None
+    args = parse_qs(referrer.query)
+    page = args.get("page", ["1"])[0]
+    return args.get("query", [""])[0], int(page) if page.isdigit() else 1
+
+# Prefetches of the next page of TMDB search results, by cache key - the same page is only prefetched once
+# however many people are reading the page before it
+search_prefetches = {}
+search_prefetch_lock = threading.Lock()
+
+# Starts fetching a page of TMDB search results into the cache on the prefetch pool, so clicking "next"
+# is answered from memory
+# Prefetches use the "prefetch" rate limit class, so they only ever use quota nothing else wants, and are
+# skipped when SEARCH_PREFETCH_MAX of them are already running or waiting for a thread
+def prefetch_search(params):
+    key = make_key("/search/movie", params)
+    with search_prefetch_lock:
+        if key in search_prefetches or tmdb_cache.info(key) is not None:
+            # Already on its way, or already there
+            return
+        if not tmdb_limiter.has_spare("prefetch") or not search_prefetch_slots.acquire(blocking=False):
+            return
+        search_prefetches[key] = prefetch_pool.submit(run_search_prefetch, key, params)
+
+# Cancels the prefetch of the page after the one the browser was reading, if it hasn't started yet
+def cancel_search_prefetch(query, page):
+    key = make_key("/search/movie", search_request(query, page + 1)[1])
+    with search_prefetch_lock:
+        future = search_prefetches.get(key)
+        # A prefetch that has started gives its slot back when it ends
+        if future is not None and future.cancel():
+            del search_prefetches[key]
+            search_prefetch_slots.release()
+
+# Runs on the prefetch pool
+def run_search_prefetch(key, params):
+    try:
+        tmdb_fetch("search", "/search/movie", params, priority="prefetch")
+    except requests.RequestException:
+        # No spare quota or TMDB is having problems - the page is fetched if the user does ask for it
+        pass
+    finally:
+        with search_prefetch_lock:
+            search_prefetches.pop(key, None)
+        search_prefetch_slots.release()
+
+# Poster images are downloaded once and then served from disk
+poster_cache = PosterCache(
+    app.config["POSTER_CACHE_DIR"],
+    app.config["POSTER_CACHE_MAX_BYTES"],
+    tmdb_client.get_image,
+)
+
+# Poster image route - serves a TMDB poster from the disk cache
+@app.route('/poster/<size>/<path>')
+def poster(size, path):
+    # Only TMDB sizes and plain file names are allowed so the route can't be used to fetch anything else
+    if size not in app.config["POSTER_SIZES"] or not POSTER_PATH_PATTERN.match(path):
+        abort(404)
+    try:
+        digest, file_path = poster_cache.get(size, path)
+    except requests.RequestException:
+        abort(404)
+    # The ETag is the hash of the image so it is safe to cache for a year
+    response = send_file(file_path, mimetype=mimetype_for(path), etag=digest, max_age=365 * 24 * 60 * 60,
+                         conditional=True, last_modified=None)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# Builds the local URL for a TMDB poster path such as "/abc123.jpg"
+@app.template_global()
+def poster_url(poster_path, size="w500"):
+    if not poster_path:
+        return None
+    return url_for('poster', size=size, path=poster_path.lstrip('/'))
+
+# Builds a srcset with every cached poster size so the browser can pick the smallest one that fits
+@app.template_global()
+def poster_srcset(poster_path):
+    if not poster_path:
+        return None
+    return ", ".join(f"{poster_url(poster_path, size)} {size[1:]}w" for size in app.config["POSTER_SRCSET_SIZES"])
+
+# function to get a JSON response from the TMDB API, served from the cache when possible
+# kind picks the cache TTL from the config - "trending", "search" or "movie"
+# fresh=True skips the cache lookup and always asks TMDB (the result is still cached)
+# local is an optional function that returns a stored copy (or None) to use instead of calling TMDB
+# priority replaces the kind's rate limiter class, such as "prefetch" for pages nobody has asked for yet
+def tmdb_fetch(kind, endpoint, params=None, fresh=False, local=None, priority=None):
+    params = params or {}
+    key = make_key(endpoint, params)
+    if not fresh:
+        data = tmdb_cache.get(key)
+        if data is not None:
+            return data
+
+    def load():
+        if local is not None and not fresh:
+            data = local()
+            if data is not None:
+                remember_tmdb_response(kind, key, data, index=False)
+                return data
+        # Failed requests raise here so they are never cached
+        response = tmdb_client.get(endpoint, params, priority=priority or TMDB_PRIORITIES[kind])
         data = response.json()
+        remember_tmdb_response(kind, key, data, response.content)
+        return data
+
+    # Concurrent misses for the same key wait on one fetch instead of all hitting TMDB
+    try:
+        return tmdb_flight.do(key, load)
+    except requests.RequestException:
+        # TMDB is down, slow or its circuit is open - an expired copy is better than an error page
+        stale = None if fresh else tmdb_cache.get_stale(key)
+        if stale is None:
+            raise
+        return stale
+
+# Rate limiter class for each kind of TMDB call
+TMDB_PRIORITIES = {"trending": "background", "movie": "page", "search": "search"}
+
+# Caches a TMDB response under its key - also used by the async fetch in asgi.py
+# content is the raw body, or None for a stored copy, which is fingerprinted as sorted JSON instead
+def remember_tmdb_response(kind, key, data, content=None, index=True):
+    if content is None:
+        content = json.dumps(data, sort_keys=True).encode("utf-8")
+    # The version is a hash of the body so it only changes when TMDB's data does
+    tmdb_cache.set(key, data, ttl=app.config["TMDB_CACHE_TTL"][kind], size=len(content),
+                   version=hashlib.sha1(content).hexdigest()[:16])
+    if index:
+        # Remember every movie we see so later searches can be answered locally
+        search_index.index_payload(get_thread_db(app.config), data)
+        suggest_index.add(search_index.movies_from_payload(data))
+
+# TMDB endpoint and parameters for a movie's details page
+def movie_request(movie_id):
+    return f"/movie/{movie_id}", {"append_to_response": "credits"}
+
+# (version, stored_at) of the cached TMDB response for an endpoint, or (None, None) if it isn't cached
+def tmdb_version(endpoint, params=None):
+    return tmdb_cache.info(make_key(endpoint, params)) or (None, None)
+
+# The trending list is refreshed in the background so the home page never waits on TMDB
+# Only the very first request waits, when there is no copy of the list yet
+def load_trending():
+    endpoint = "/trending/movie/day"
+    # With the shared cache another worker may have refreshed the list a moment ago - only ask TMDB
+    # if the cached copy is more than half a refresh interval old
+    _, stored_at = tmdb_version(endpoint)
+    fresh = stored_at is None or time.time() - stored_at >= app.config["TRENDING_REFRESH_INTERVAL"] / 2
+    try:
+        return tmdb_fetch("trending", endpoint, fresh=fresh)
+    except requests.RequestException:
+        # With no TMDB (such as offline staging) fall back to the most popular ingested movies
+        data = search_index.top_movies(get_thread_db(app.config))
+        if not data["results"]:
+            raise
+        return data
+
+trending_refresher = BackgroundRefresher(
+    "trending",
+    load_trending,
+    interval=app.config["TRENDING_REFRESH_INTERVAL"],
+)
+
+# function to get movies from the TMDB API and display them on the homepage 
+def get_movies(count = 10, image_size = "w342"):
+        # Get the last good copy of the trending movies
+        try:
+            data = trending_refresher.get()
+        except requests.RequestException:
+            # We have never had a copy and TMDB is down - show the page without the carousel
+            return []
         # Process and return a list of movies
         movies = []
         for movie in data["results"]:
             if len(movies) >= count:
                 break
             poster_path = movie.get("poster_path")
-            poster_url = f"https://image.tmdb.org/t/p/{image_size}{poster_path}" if poster_path else None
             movie_data = {
                 "title": movie["title"],
                 "release_date": movie["release_date"],
                 "overview": movie["overview"],
-                "poster_path": poster_url,
+                "poster_path": poster_url(poster_path, image_size),
+                "poster_srcset": poster_srcset(poster_path),
                 "id": movie["id"],
                 "vote_average": movie["vote_average"],
                 "vote_count": movie["vote_count"]
@@ -211,18 +572,122 @@ def get_movies(count = 10, image_size = "w500"):
             movies.append(movie_data)
         return movies
 
+# Loads the search as you type index, the trending list and the details of its top movies into the caches,
+# and renders the home page once so its templates are compiled and its carousel fragment is cached
+# Used by wsgi.py before the server takes traffic - returns how many movies were warmed
+def warm_caches(movie_count):
+    # Loading every catalog title can take a few seconds - better here than on someone's first keystroke
+    suggest_index.refresh(lambda: get_thread_db(app.config))
+    try:
+        data = trending_refresher.get()
+    except Exception:
+        # Start anyway - the first requests will just be slower
+        app.logger.exception("Could not load the trending list while warming the caches")
+        return 0
+    movie_ids = [movie["id"] for movie in data["results"][:movie_count]]
+
+    def warm(movie_id):
+        try:
+            tmdb_fetch("movie", *movie_request(movie_id),
+                       local=lambda: search_index.get_payload(get_thread_db(app.config), movie_id))
+            return True
+        except requests.RequestException:
+            return False
+        finally:
+            database.close_thread_db()
+
+    # A pool of its own that is shut down afterwards, so no threads are left over when workers are forked
+    with ThreadPoolExecutor(max_workers=app.config["TMDB_FETCH_WORKERS"]) as pool:
+        warmed = sum(pool.map(warm, movie_ids))
+    # Render the home page once - if it fails say so, otherwise the first visitor finds out instead
+    try:
+        response = app.test_client().get('/')
+    except Exception:
+        app.logger.exception("Could not render the home page while warming the caches")
+    else:
+        if response.status_code != 200:
+            app.logger.warning("Rendering the home page while warming the caches returned %s", response.status_code)
+    return warmed
+
 # Add Movie Details Route
+# The TMDB fetch runs on the fetch pool while this thread reads the reviews and comments,
+# so the page takes as long as the slowest of the two instead of both added together
 @app.route('/movie/<int:movie_id>')
 def movie_details(movie_id):
-    # Fetch movie details from TMDB API
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}"
-    response = requests.get(url, params={"api_key": TMDB_API, "append_to_response": "credits"})
-    response.raise_for_status()
-    movie = response.json()
+    # Movies loaded with "flask ingest-catalog" are served from the stored details payload
+    endpoint, params = movie_request(movie_id)
+    movie = tmdb_cache.get(make_key(endpoint, params))
+    movie_future = None
+    # Under the async serving mode the fetch already happened on the event loop
+    if movie is None and tmdb_prefetch.get() is None:
+        # Worker threads can't use the request's connection, so the stored payload is read on their own one
+        movie_future = fetch_pool.submit(tmdb_fetch, "movie", endpoint, params,
+                                         local=lambda: search_index.get_payload(get_thread_db(app.config), movie_id))
+    # The newest review and comment - a new one of either changes the page
+    conn = get_db()
+    latest_review = conn.execute("SELECT timestamp, id FROM review WHERE movie_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1", (movie_id,)).fetchone()
+    latest_comment = conn.execute("SELECT timestamp, id FROM comment WHERE post_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1", (movie_id,)).fetchone()
+    max_age = app.config["PAGE_CACHE_MAX_AGE"]
+    validators = None
+    movie_version = None
+    if movie is not None:
+        # Cached movie - a 304 can be sent before doing any more work
+        # The version changes whenever the movie's payload changes - it also keys the cached header fragment
+        movie_version, movie_stored_at = tmdb_version(endpoint, params)
+        validators = movie_page_validators(movie_id, movie_version, movie_stored_at, latest_review, latest_comment)
+        cached = not_modified(validators, max_age)
+        if cached is not None:
+            return cached
+    # Cursors for the "load more" links - a missing cursor means the first page
+    reviews_after = request.args.get('reviews_after')
+    comments_after = request.args.get('comments_after')
+    page_size = app.config["MOVIE_PAGE_SIZE"]
+    # Fetch one page of reviews for the movie with username
+    reviews, next_reviews = keyset_page(
+        conn,
+        "SELECT review.id, review.movie_id, review.rating, review.comment, review.user_id, user.username, review.timestamp, review.id FROM review JOIN user ON review.user_id = user.id",
+        "review.movie_id = ?", [movie_id],
+        "review.timestamp", "review.id",
+        after=reviews_after, page_size=page_size,
+    )
+    
+    # Fetch one page of comments for the movie with username
+    comments, next_comments = keyset_page(
+        conn,
+        "SELECT comment.id, comment.post_id, comment.user_id, comment.content, user.username, comment.timestamp, comment.id FROM comment JOIN user ON comment.user_id = user.id",
+        "comment.post_id = ?", [movie_id],
+        "comment.timestamp", "comment.id",
+        after=comments_after, page_size=page_size,
+    )
+    # CineFiles users' own rating for the movie - one row lookup
+    rating_summary = ratings.get_rating_summary(conn, movie_id)
+    if movie_future is not None:
+        try:
+            movie = movie_future.result(timeout=app.config["MOVIE_TMDB_DEADLINE"])
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                abort(404)
+        except (FutureTimeout, requests.RequestException):
+            # A late fetch keeps going in the background and fills the cache for the next view
+            pass
+    elif movie is None and tmdb_prefetch.get() == "not_found":
+        abort(404)
+    if movie is None:
+        # TMDB is down, slow or its circuit is open - an expired copy is better than no details
+        movie = tmdb_cache.get_stale(make_key(endpoint, params))
+    degraded = movie is None
+    if degraded:
+        # Show what the catalog knows about the movie with the local reviews and comments
+        movie = search_index.get_movie(conn, movie_id) or {"id": movie_id, "title": f"Movie #{movie_id}"}
+    elif movie_version is None:
+        # Fetched while the database was being read - a 304 is still possible
+        movie_version, movie_stored_at = tmdb_version(endpoint, params)
+        validators = movie_page_validators(movie_id, movie_version, movie_stored_at, latest_review, latest_comment)
+        cached = not_modified(validators, max_age)
+        if cached is not None:
+            return cached
     # Get poster image for the movie
     poster_path = movie.get("poster_path")
-    # Build full poster URL
-    poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
     
     # Get genres
     genres = ", ".join([genre["name"] for genre in movie.get("genres", [])])
@@ -245,7 +710,8 @@ def movie_details(movie_id):
         "title": movie["title"],
         "release_date": movie.get("release_date", "N/A"),
         "overview": movie.get("overview", "No overview available"),
-        "poster_url": poster_url,
+        "poster_url": poster_url(poster_path),
+        "poster_srcset": poster_srcset(poster_path),
         "id": movie["id"],
         "vote_average": movie.get("vote_average", 0),
         "vote_count": movie.get("vote_count", 0),
@@ -253,19 +719,27 @@ def movie_details(movie_id):
         "director": director,
         "cast": cast
     }
-    # Fetch any existing reviews for the movie with username
-    conn = sqlite3.connect('instance/cinefiles.db')
-    cursor = conn.cursor()
-    query = f"SELECT review.id, review.movie_id, review.rating, review.comment, review.user_id, user.username FROM review JOIN user ON review.user_id = user.id WHERE review.movie_id = {movie_id}"
-    cursor.execute(query)
-    reviews = cursor.fetchall()
-    
-    # Fetch any existing comments for the movie with username
-    query = f"SELECT comment.id, comment.post_id, comment.user_id, comment.content, user.username FROM comment JOIN user ON comment.user_id = user.id WHERE comment.post_id = {movie_id}"
-    cursor.execute(query)
-    comments = cursor.fetchall()
-    conn.close()
-    return render_template('movie.html', movie=movie_data, reviews=reviews, comments=comments)
+    response = make_response(render_template('movie.html', movie=movie_data, reviews=reviews, comments=comments,
+                           rating_summary=rating_summary, movie_version=movie_version, degraded=degraded,
+                           reviews_after=reviews_after, comments_after=comments_after,
+                           next_reviews=next_reviews, next_comments=next_comments))
+    return add_validators(response, validators, max_age)
+
+# Validators for a movie page - the movie's cached TMDB version and the newest review and comment
+# Returns None (don't reuse the page) when the movie isn't cached
+def movie_page_validators(movie_id, movie_version, movie_stored_at, latest_review, latest_comment):
+    if movie_version is None:
+        return None
+    last_modified = max([movie_stored_at or 0] + [parse_db_timestamp(row[0]) for row in (latest_review, latest_comment) if row])
+    return page_validators("movie", movie_id, movie_version, latest_review, latest_comment,
+                           request.query_string, last_modified=last_modified)
+
+# Turns a SQLite CURRENT_TIMESTAMP value ("2026-10-17 09:30:00", in UTC) into unix time
+def parse_db_timestamp(value):
+    try:
+        return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return 0
 
 # Route to add a review for a movie
 @app.route('/movie/<int:movie_id>/review', methods=['POST'])
@@ -284,17 +758,21 @@ def add_review(movie_id):
         flash("Please provide a rating.")
         return redirect(url_for('movie_details', movie_id=movie_id))
     # Direct database connection using sqlite3 - allows for SQL injection
-    conn = sqlite3.connect('instance/cinefiles.db')
+    conn = get_db()
     cursor = conn.cursor()
     query = f"INSERT INTO review (movie_id, rating, comment, user_id) VALUES ({movie_id}, {rating}, '{comment}', {user_id})"
     try:
         cursor.execute(query)
+        # Update the movie's rating aggregate in the same transaction using the rating that was stored
+        stored = conn.execute("SELECT movie_id, rating FROM review WHERE rowid = ?", (cursor.lastrowid,)).fetchone()
+        if stored:
+            ratings.record_rating(conn, stored[0], stored[1])
         conn.commit()
         flash("Review added successfully!")
     except sqlite3.Error as e:
+        # Roll back so a half finished review never leaves the aggregate out of step
+        conn.rollback()
         flash(f"An error occurred: {e}")
-    finally:
-        conn.close()
     return redirect(url_for('movie_details', movie_id=movie_id))
 
 # Route to add a comment to a movie discussion
@@ -310,7 +788,7 @@ def add_comment(movie_id):
         flash("Please provide comment content.")
         return redirect(url_for('movie_details', movie_id=movie_id))
     # Insert comment into database
-    conn = sqlite3.connect('instance/cinefiles.db')
+    conn = get_db()
     cursor = conn.cursor()
     query = f"INSERT INTO comment (post_id, user_id, content) VALUES ({movie_id}, {user_id}, '{content}')"
     try:
@@ -319,15 +797,147 @@ def add_comment(movie_id):
         flash("Comment added successfully!")
     except sqlite3.Error as e:
         flash(f"An error occurred: {e}")
-    finally:
-        conn.close()
     return redirect(url_for('movie_details', movie_id=movie_id))
 
+#### JSON API ####
+# Monitoring - TMDB circuit breakers and rate limit, the trending refresh and the caches
+@app.route('/api/status')
+def api_status():
+    return jsonify(
+        breakers=[tmdb_breaker.status(), image_breaker.status()],
+        rate_limit=tmdb_limiter.status(),
+        trending=trending_refresher.status(),
+        tmdb_cache=tmdb_cache.stats(),
+        fragment_cache=app.jinja_env.fragment_cache.stats(),
+        poster_cache=poster_cache.stats(),
+        suggest=suggest_index.status(),
+    )
+
+# Review columns for the JSON API - keyset pagination needs the timestamp and id last
+REVIEW_COLUMNS = "review.id, review.rating, review.comment, user.username, review.timestamp, review.id"
+REVIEW_TABLES = "review JOIN user ON review.user_id = user.id"
+
+# Shapes a review row for the JSON API
+def review_json(row):
+    return {"id": row[0], "rating": row[1], "comment": row[2], "user": row[3], "timestamp": row[4]}
+
+# Shapes a TMDB details payload for the JSON API - only what a client needs to show a list of movies
+def movie_json(movie, rating_summary):
+    return {
+        "id": movie["id"],
+        "title": movie.get("title"),
+        "release_date": movie.get("release_date"),
+        "poster": poster_url(movie.get("poster_path"), "w342"),
+        "vote_average": movie.get("vote_average", 0),
+        "vote_count": movie.get("vote_count", 0),
+        "genres": [genre["name"] for genre in movie.get("genres", [])],
+        # CineFiles users' own rating
+        "rating": {"count": rating_summary["count"], "average": rating_summary["average"]} if rating_summary else None,
+    }
+
+# Fetches the details of many movies at once
+# Cached movies come straight from memory, ingested ones from one IN (...) query on movie_payload,
+# and only the rest go to TMDB, all at the same time on the fetch pool
+# Returns (movies by id, ids TMDB doesn't know, ids that couldn't be fetched right now)
+def fetch_movies(movie_ids):
+    movies, not_found, unavailable = {}, [], []
+    uncached = []
+    for movie_id in movie_ids:
+        data = tmdb_cache.get(make_key(*movie_request(movie_id)))
+        if data is not None:
+            movies[movie_id] = data
+        else:
+            uncached.append(movie_id)
+    stored = search_index.get_payloads(get_db(), uncached)
+
+    def fetch(movie_id):
+        return tmdb_fetch("movie", *movie_request(movie_id), local=lambda: stored.get(movie_id))
+
+    futures = {}
+    for movie_id in uncached:
+        if movie_id in stored:
+            # Goes through tmdb_fetch so the stored copy is cached like any other
+            movies[movie_id] = fetch(movie_id)
+        else:
+            futures[movie_id] = fetch_pool.submit(fetch, movie_id)
+    for movie_id, future in futures.items():
+        try:
+            movies[movie_id] = future.result()
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                not_found.append(movie_id)
+            else:
+                unavailable.append(movie_id)
+        except requests.RequestException:
+            unavailable.append(movie_id)
+    return movies, not_found, unavailable
+
+# Batch movie lookup - /api/movies?ids=1,2,3
+# reviews=N adds the first N reviews of every movie, loaded with one query for all of them
+@app.route('/api/movies')
+def api_movies():
+    parts = [part.strip() for part in request.args.get('ids', '').split(',') if part.strip()]
+    try:
+        # Duplicates are dropped but the order is kept
+        movie_ids = list(dict.fromkeys(int(part) for part in parts))
+    except ValueError:
+        return jsonify(error="ids must be a comma separated list of movie ids"), 400
+    if not movie_ids:
+        return jsonify(error="ids is required"), 400
+    if len(movie_ids) > app.config["API_MAX_IDS"]:
+        return jsonify(error=f"at most {app.config['API_MAX_IDS']} ids can be asked for at once"), 400
+    reviews_per_movie = min(max(request.args.get('reviews', 0, type=int), 0), app.config["MOVIE_PAGE_SIZE"])
+    movies, not_found, unavailable = fetch_movies(movie_ids)
+    found = [movie_id for movie_id in movie_ids if movie_id in movies]
+    conn = get_db()
+    summaries = ratings.get_rating_summaries(conn, found)
+    pages = {}
+    if reviews_per_movie:
+        pages = first_pages(conn, REVIEW_COLUMNS, REVIEW_TABLES, "review.movie_id", found,
+                            "review.timestamp", "review.id", page_size=reviews_per_movie)
+    results = []
+    for movie_id in found:
+        item = movie_json(movies[movie_id], summaries.get(movie_id))
+        if reviews_per_movie:
+            rows, next_cursor = pages.get(movie_id, ([], None))
+            item["reviews"] = [review_json(row) for row in rows]
+            # Carry on with /api/movies/<id>/reviews?after=<cursor>
+            item["reviews_next"] = next_cursor
+        results.append(item)
+    return jsonify(movies=results, not_found=not_found, unavailable=unavailable)
+
+# Search as you type - /api/suggest?q=<what has been typed so far>
+# Answered from the in-memory title index only, never TMDB - typeahead sends far more requests
+# than full searches and would use up the TMDB quota on its own
+@app.route('/api/suggest')
+def api_suggest():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', app.config["SUGGEST_LIMIT"], type=int), 1), app.config["SUGGEST_LIMIT"])
+    suggest_index.refresh(get_db)
+    response = jsonify(query=query, suggestions=suggest_index.suggest(query, limit))
+    # The same few letters get typed over and over - let the browser reuse answers for a minute
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
+
+# One page of a movie's reviews - /api/movies/<id>/reviews?after=<cursor>
+@app.route('/api/movies/<int:movie_id>/reviews')
+def api_movie_reviews(movie_id):
+    conn = get_db()
+    rows, next_cursor = keyset_page(
+        conn,
+        f"SELECT {REVIEW_COLUMNS} FROM {REVIEW_TABLES}",
+        "review.movie_id = ?", [movie_id],
+        "review.timestamp", "review.id",
+        after=request.args.get('after'), page_size=app.config["MOVIE_PAGE_SIZE"],
+    )
+    return jsonify(movie_id=movie_id, rating=ratings.get_rating_summary(conn, movie_id),
+                   reviews=[review_json(row) for row in rows], next=next_cursor)
+
 # Run the application
 if __name__ == '__main__':
     with app.app_context():
-        # Create database tables
-        db.create_all()
+        # Create database tables and apply any schema changes that have not been run yet
+        migrations.setup_schema(app)
         # Propagate exceptions causes detailed error messages to be shown - Bad security
         app.config['PROPAGATE_EXCEPTIONS'] = True
         # Debug mode can expose errors and sensitive information - Bad security  
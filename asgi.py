@@ -0,0 +1,168 @@
+# ASGI entry point - async serving mode for the pages that wait on TMDB
+# Run it with an ASGI server, such as: uvicorn asgi:application --port 5000
+#
+# The home, search and movie pages do their waiting on TMDB here, on the event loop, with a pooled
+# async HTTP client, so one process can have thousands of slow TMDB requests in flight without a thread each.
+# Once the data is cached the normal Flask view renders the page from the cache in a worker thread, so
+# sessions, templates, 304s and everything else work exactly the same as under WSGI.
+# Every other URL goes straight to the Flask app.
+
+# Import statements
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+# asgiref runs the Flask (WSGI) app from the event loop, httpx is the async HTTP client
+import httpx
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+import requests
+
+from app import (app as flask_app, TMDB_API, TMDB_PRIORITIES, tmdb_breaker, tmdb_limiter, tmdb_cache, tmdb_prefetch,
+                 remember_tmdb_response, movie_request, search_request, trending_refresher)
+from cache import AsyncSingleFlight, make_key
+from database import get_thread_db
+import search_index
+from tmdb import AsyncTMDBClient
+
+
+MOVIE_PATH = re.compile(r"^/movie/(\d+)$")
+
+
+# On its own WsgiToAsgi runs every WSGI call on one thread shared by the whole process
+# ThreadSensitiveContext is asgiref's public way to give each request a thread of its own instead,
+# and the semaphore keeps it to at most `threads` pages being rendered at once
+class _WsgiApp(WsgiToAsgi):
+    def __init__(self, wsgi_application, threads):
+        super().__init__(wsgi_application)
+        self._slots = asyncio.Semaphore(threads)
+
+    async def __call__(self, scope, receive, send):
+        async with self._slots:
+            async with ThreadSensitiveContext():
+                await super().__call__(scope, receive, send)
+
+
+class AsyncApp:
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = _WsgiApp(app, app.config["ASGI_RENDER_THREADS"])
+        # Concurrent misses for the same key wait on one fetch instead of all hitting TMDB
+        self.flight = AsyncSingleFlight()
+        self._client = None
+
+    # Created on first use so it belongs to the server's event loop
+    @property
+    def client(self):
+        if self._client is None:
+            config = self.app.config
+            self._client = AsyncTMDBClient(
+                TMDB_API,
+                pool_size=config["TMDB_ASYNC_POOL_SIZE"],
+                connect_timeout=config["TMDB_CONNECT_TIMEOUT"],
+                read_timeout=config["TMDB_READ_TIMEOUT"],
+                max_retries=config["TMDB_MAX_RETRIES"],
+                backoff_factor=config["TMDB_RETRY_BACKOFF"],
+                # Shared with the sync client, so an open circuit stops both and they share one quota
+                breaker=tmdb_breaker,
+                limiter=tmdb_limiter,
+            )
+        return self._client
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            # The view reads how the fetch went - each request runs in its own context so this is per request
+            tmdb_prefetch.set(await self.prefetch(scope))
+        await self.wsgi(scope, receive, send)
+
+    # Startup and shutdown messages from the server - the TMDB connections are closed on shutdown
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._client is not None:
+                    await self._client.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # Gets the TMDB data a page needs into the cache before the view runs
+    # Returns how the fetch went for tmdb_prefetch, or None if the page doesn't need one
+    async def prefetch(self, scope):
+        config = self.app.config
+        path = scope["path"]
+        if path == "/":
+            # The trending list is kept fresh by its background thread - only the very first request
+            # has to wait for it, and that happens in a worker thread instead of the event loop
+            if trending_refresher.version is None:
+                try:
+                    await asyncio.to_thread(trending_refresher.get)
+                except Exception:
+                    # The view shows the error the same way as under WSGI
+                    pass
+            return None
+        if path == "/search":
+            args = parse_qs(scope["query_string"].decode("latin-1"))
+            query = args.get("query", [""])[0]
+            page = args.get("page", ["1"])[0]
+            page = min(max(int(page), 1), config["SEARCH_MAX_PAGES"]) if page.isdigit() else 1
+            # Same as the view - TMDB is only asked for source=tmdb, or for a first page the local index has nothing for
+            if args.get("source", [""])[0] != "tmdb":
+                if page > 1:
+                    return None
+                local = await asyncio.to_thread(
+                    lambda: search_index.search(get_thread_db(config), query, limit=1)
+                )
+                if local:
+                    return None
+            return await self.fetch("search", *search_request(query, page))
+        match = MOVIE_PATH.match(path)
+        if match:
+            movie_id = int(match.group(1))
+            endpoint, params = movie_request(movie_id)
+            return await self.fetch(
+                "movie", endpoint, params,
+                local=lambda: search_index.get_payload(get_thread_db(config), movie_id),
+                deadline=config["MOVIE_TMDB_DEADLINE"],
+            )
+        return None
+
+    # Async version of tmdb_fetch - caches the response the same way, then returns
+    # "ok", "not_found" or "failed"
+    # local is an optional function that returns a stored copy (or None) to use instead of calling TMDB
+    async def fetch(self, kind, endpoint, params, local=None, deadline=None):
+        key = make_key(endpoint, params)
+        if tmdb_cache.get(key) is not None:
+            return "ok"
+
+        async def load():
+            if local is not None:
+                data = await asyncio.to_thread(local)
+                if data is not None:
+                    await asyncio.to_thread(remember_tmdb_response, kind, key, data, None, False)
+                    return data
+            response = await self.client.get(endpoint, params, priority=TMDB_PRIORITIES[kind])
+            data = response.json()
+            # Caching indexes the movies into SQLite, so it runs off the event loop
+            await asyncio.to_thread(remember_tmdb_response, kind, key, data, response.content)
+            return data
+
+        try:
+            # A fetch that misses the deadline keeps going and fills the cache for the next view
+            await asyncio.wait_for(self.flight.do(key, load), timeout=deadline)
+        except asyncio.TimeoutError:
+            return "failed"
+        except httpx.HTTPStatusError as e:
+            return "not_found" if e.response.status_code == 404 else "failed"
+        except (httpx.HTTPError, requests.RequestException):
+            # Including an open circuit and running out of quota
+            return "failed"
+        return "ok"
+
+
+application = AsyncApp(flask_app)
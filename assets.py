@@ -0,0 +1,99 @@
+# Import statements
+# click is used for the "flask build-assets" command
+import click
+# hashlib gives every asset a file name based on its content
+import hashlib
+import json
+import os
+import shutil
+from flask import request, current_app
+from flask.cli import with_appcontext
+
+
+# Fingerprinted copies and the manifest live in this folder inside static/
+DIST_FOLDER = "dist"
+MANIFEST_NAME = "manifest.json"
+# One year - fingerprinted files never change, a new version gets a new name
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# Copies every static file to dist/ under a name containing a hash of its content,
+# such as style.css -> dist/style.3f9a1c2b.css, and writes a manifest mapping the two
+# Returns the manifest
+def build_manifest(static_folder):
+    dist_folder = os.path.join(static_folder, DIST_FOLDER)
+    os.makedirs(dist_folder, exist_ok=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        # Don't fingerprint the fingerprinted copies
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_folder]
+        for name in files:
+            # Precompressed copies are made from the fingerprinted files by "flask compress-static"
+            if name.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:8]
+            stem, extension = os.path.splitext(relative)
+            hashed = f"{DIST_FOLDER}/{stem}.{digest}{extension}"
+            target = os.path.join(static_folder, hashed)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(path, target)
+            manifest[relative] = hashed
+    temp_path = os.path.join(dist_folder, MANIFEST_NAME + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, os.path.join(dist_folder, MANIFEST_NAME))
+    return manifest
+
+
+# Reads the manifest - an empty one (no fingerprinting) if "flask build-assets" hasn't been run
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, DIST_FOLDER, MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Switches fingerprinting on for the app
+# url_for('static', filename='style.css') then builds the fingerprinted URL everywhere, templates included
+def init_app(app):
+    app.extensions["asset_manifest"] = load_manifest(app.static_folder)
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == "static":
+            hashed = app.extensions["asset_manifest"].get(values.get("filename"))
+            if hashed:
+                values["filename"] = hashed
+
+    # Fingerprinted files never change, so browsers can keep them for a year without asking again
+    @app.after_request
+    def cache_fingerprinted_assets(response):
+        if (
+            request.endpoint == "static"
+            and response.status_code in (200, 304)
+            and (request.view_args or {}).get("filename", "").startswith(DIST_FOLDER + "/")
+        ):
+            # send_file marks static files no-cache by default
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+
+# CLI command: flask --app app build-assets
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    """Regenerate the fingerprinted static files and their manifest."""
+    manifest = build_manifest(current_app.static_folder)
+    current_app.extensions["asset_manifest"] = manifest
+    for original, hashed in sorted(manifest.items()):
+        click.echo(f"{original} -> {hashed}")
+    click.echo("Run 'flask compress-static' afterwards to precompress the new files.")
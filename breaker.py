@@ -0,0 +1,131 @@
+# Import statements
+# deque keeps the outcomes of the most recent calls
+from collections import deque
+# logging records every time the circuit opens or closes
+import logging
+import threading
+import time
+
+# CircuitOpenError is a requests error so every route that already copes with TMDB failing
+# (cached copies, saved search results, the degraded movie page) copes with an open circuit too
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Raised instead of calling TMDB while the circuit is open
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+# Circuit breaker for calls to an upstream service such as TMDB
+# Watches the last window calls - once at least min_calls have been made and too many of them failed
+# or were slow, the circuit opens and calls fail straight away for open_seconds instead of piling up
+# behind a service that isn't answering. After that a few probe calls are let through (half open):
+# if they all work the circuit closes again, if one fails it opens for another open_seconds
+#
+# Callers use it like this:
+#     breaker.allow()                     # raises CircuitOpenError if the call isn't allowed
+#     ... make the call ...
+#     breaker.record(success, duration)   # duration in seconds
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=10, failure_rate=0.5, slow_call_seconds=2.0,
+                 slow_rate=0.5, open_seconds=30, half_open_calls=3):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        # (success, slow) for each recent call
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = None
+        self._probes_started = 0
+        self._probes_passed = 0
+        # Counters for monitoring
+        self.rejected = 0
+        self.times_opened = 0
+
+    # Raises CircuitOpenError if a call isn't allowed right now
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                # Time to find out if the service is back
+                self._set_state(HALF_OPEN)
+                self._probes_started = 0
+                self._probes_passed = 0
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is half open and already probing")
+                self._probes_started += 1
+
+    # Records how an allowed call went
+    def record(self, success, duration):
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if not success or slow:
+                    self._open()
+                    return
+                self._probes_passed += 1
+                if self._probes_passed >= self.half_open_calls:
+                    self._calls.clear()
+                    self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                # A call that started before the circuit opened - it doesn't change anything
+                return
+            self._calls.append((success, slow))
+            if len(self._calls) < self.min_calls:
+                return
+            failures, slows = self._rates()
+            if failures >= self.failure_rate or slows >= self.slow_rate:
+                self._open()
+
+    # Information about the circuit for monitoring
+    def status(self):
+        with self._lock:
+            failures, slows = self._rates()
+            return {
+                "name": self.name,
+                "state": self.state,
+                "recent_calls": len(self._calls),
+                "failure_rate": round(failures, 3),
+                "slow_rate": round(slows, 3),
+                "open_for": round(max(0.0, self.open_seconds - (time.monotonic() - self.opened_at)), 1)
+                if self.state == OPEN else 0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+    # Must be called with the lock held
+    def _rates(self):
+        if not self._calls:
+            return 0.0, 0.0
+        failures = sum(1 for success, _ in self._calls if not success)
+        slows = sum(1 for _, slow in self._calls if slow)
+        return failures / len(self._calls), slows / len(self._calls)
+
+    # Must be called with the lock held
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._set_state(OPEN)
+
+    # Must be called with the lock held
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("%s circuit %s -> %s", self.name, self.state, state)
+            self.state = state
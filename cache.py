@@ -0,0 +1,216 @@
+# Import statements
+# asyncio is used by the single-flight helper for the async serving mode
+import asyncio
+# OrderedDict keeps entries in access order which gives us LRU eviction for free
+from collections import OrderedDict
+# json is used to estimate how much memory a cached value takes up
+import json
+# threading lock so several worker threads can share the same cache safely
+import threading
+import time
+
+
+# Builds a cache key out of an endpoint and its query parameters
+# The api key is left out so it never ends up stored in the cache
+def make_key(endpoint, params=None):
+    params = params or {}
+    parts = [f"{name}={params[name]}" for name in sorted(params) if name != "api_key"]
+    return endpoint + "?" + "&".join(parts)
+
+
+# Rough size of a value in bytes - used for the memory bound
+# Strings and bytes are measured directly, anything else is measured as JSON
+def approx_size(value):
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, separators=(",", ":"), default=str))
+
+
+# In-memory cache with a time to live on every entry and LRU eviction
+# Eviction kicks in when there are too many entries or they take up too much memory
+class TTLCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, default_ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (expires_at, size, version, stored_at, value)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Every set() gets a new version so callers can tell when a value was replaced
+        # Callers can pass their own, such as a hash of the content
+        self._version = 0
+        self._lock = threading.Lock()
+        # Counters so we can see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Returns the cached value or the default if the key is missing or has expired
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, size, _, _, value = entry
+            if expires_at <= time.monotonic():
+                # Expired entries count as a miss but are kept until they are evicted,
+                # as a last resort for get_stale()
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # Move the key to the end so it is the most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Stores a value - ttl is in seconds and size can be passed in if already known
+    def set(self, key, value, ttl=None, size=None, version=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        size = approx_size(value) if size is None else size
+        # Values bigger than the whole cache are not worth storing
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if version is None:
+                self._version += 1
+                version = self._version
+            self._entries[key] = (time.monotonic() + ttl, size, version, time.time(), value)
+            self._bytes += size
+            # Evict the least recently used entries until we are back under the limits
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    # Returns (version, stored_at) for a live entry, or None if the key is missing or has expired
+    # stored_at is the unix time the value was set
+    # Does not count as a hit or a miss and does not change the LRU order
+    def info(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[2], entry[3]
+
+    # Returns the version of a live entry, or None if the key is missing or has expired
+    def version(self, key):
+        info = self.info(key)
+        return info[0] if info else None
+
+    # Returns the value even if it has expired, or the default if it has been evicted
+    # A last resort for when the value can't be loaded again, such as when TMDB is down
+    # Does not count as a hit or a miss and does not change the LRU order
+    def get_stale(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[4]
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # Snapshot of the counters - handy for logging or a status page
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Must be called with the lock held
+    def _remove(self, key):
+        _, size, _, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+# Keeps track of one call that is currently in progress
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Single-flight request coalescing
+# When several threads ask for the same key at the same time only the first one
+# actually runs the function - the others wait for it and share its result (or its error)
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        # How many callers were given another caller's result instead of doing the work
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            # BaseException too - if the leader is interrupted (KeyboardInterrupt, GreenletExit) the waiters
+            # must get the error, not a None that looks like a real result
+            call.error = e
+            raise
+        finally:
+            # Forget the call before waking the waiters so the next miss starts a fresh fetch
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# Single-flight request coalescing for coroutines, used by the async serving mode (asgi.py)
+# The first caller's fetch runs as a task and everyone else asking for the same key awaits that task
+# The task is shielded, so a caller that gives up (such as on a deadline) doesn't cancel the fetch for the others
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+        # How many callers were given another caller's result instead of doing the work
+        self.shared = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        # Forget the call so the next miss starts a fresh fetch
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the error as seen - if every caller gave up nobody else will
+        if not task.cancelled():
+            task.exception()
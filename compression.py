@@ -0,0 +1,145 @@
+# Import statements
+# click is used for the "flask compress-static" command
+import click
+# gzip is always available, brotli is optional and only used if it is installed
+import gzip
+import mimetypes
+import os
+from flask import request, send_from_directory, current_app
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Types of response worth compressing - images are already compressed
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "image/svg+xml",
+}
+
+# File extensions that "flask compress-static" precompresses
+STATIC_EXTENSIONS = (".css", ".js", ".svg", ".html", ".json", ".txt")
+
+
+# Picks the best encoding the browser accepts - brotli first if we have it, then gzip
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        # Brotli quality goes up to 11 - scale the gzip style 1-9 level onto it
+        return brotli.compress(data, quality=min(11, level + 2))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+# after_request hook - compresses HTML, JSON and other text responses on the way out
+def compress_response(response):
+    config = current_app.config
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    # The response is different depending on Accept-Encoding, so caches need to know
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    # Tiny responses can get bigger when compressed and aren't worth the CPU
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    response.set_data(compress(data, encoding, config["COMPRESS_LEVEL"]))
+    response.headers["Content-Encoding"] = encoding
+    # A compressed body is a different set of bytes, so the ETag can only be weak now
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Static file view that serves a precompressed .br or .gz copy when there is one
+# so static files never cost any compression CPU per request
+def make_static_view(app):
+    original = app.view_functions["static"]
+
+    def static(filename):
+        # Best encoding first - a missing .br copy falls back to the .gz one
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if not request.accept_encodings[encoding]:
+                continue
+            compressed_path = safe_join(app.static_folder, filename + suffix)
+            if compressed_path is None or not os.path.isfile(compressed_path):
+                continue
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype,
+                                           max_age=app.get_send_file_max_age(filename))
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
+        response = original(filename=filename)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    return static
+
+
+# Switches compression on for the app
+def init_app(app):
+    app.after_request(compress_response)
+    app.view_functions["static"] = make_static_view(app)
+
+
+# Writes .gz (and .br if brotli is installed) copies of every text file under a folder
+# Files are only rewritten when the original is newer than the compressed copy
+def precompress_folder(folder, level=9):
+    written = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if not name.endswith(STATIC_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            encodings = ["gzip"] + (["br"] if brotli is not None else [])
+            for encoding in encodings:
+                target = path + (".br" if encoding == "br" else ".gz")
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data, encoding, level)
+                # Not worth serving a compressed copy that isn't smaller
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, "wb") as f:
+                    f.write(compressed)
+                written.append((target, len(data), len(compressed)))
+    return written
+
+
+# CLI command: flask --app app compress-static
+@click.command("compress-static")
+@with_appcontext
+def compress_static_command():
+    """Precompress the files under static/ with gzip and brotli."""
+    written = precompress_folder(current_app.static_folder)
+    for target, before, after in written:
+        click.echo(f"{target}: {before} -> {after} bytes")
+    if brotli is None:
+        click.echo("brotli is not installed, only .gz files were written.")
+    click.echo(f"Wrote {len(written)} compressed files.")
@@ -0,0 +1,64 @@
+# Import statements
+# hashlib builds the ETag out of the things a page depends on
+import hashlib
+from datetime import datetime, timezone
+from flask import request, session, make_response
+from werkzeug.http import is_resource_modified
+
+
+# Validators (ETag and Last-Modified) for a page
+# Anonymous views are the same for everyone, so they get Last-Modified as well and can be cached
+# publicly by a CDN or reverse proxy - logged in views are private to the browser
+class PageValidators:
+    def __init__(self, etag, last_modified, public):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.public = public
+
+
+# Builds validators from the things a page depends on, such as data versions and latest row ids
+# last_modified is a unix time or None
+# Returns None when the response must not be reused, such as when it shows flashed messages
+def page_validators(*parts, last_modified=None):
+    # Flashed messages are only shown once so a page showing them can't be reused
+    if session.get('_flashes'):
+        return None
+    user_id = session.get('user_id')
+    raw = "|".join(str(part) for part in (user_id,) + parts)
+    etag = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+    public = user_id is None
+    if last_modified is not None and public:
+        last_modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+    else:
+        # If-Modified-Since can't tell logged in users apart, so only the ETag is used for them
+        last_modified = None
+    return PageValidators(etag, last_modified, public)
+
+
+# Returns a 304 Not Modified response if the browser's copy is still current, otherwise None
+# Call it before doing any expensive work so repeat views cost almost nothing
+def not_modified(validators, max_age=60):
+    if validators is None:
+        return None
+    if is_resource_modified(request.environ, etag=validators.etag, last_modified=validators.last_modified):
+        return None
+    return add_validators(make_response("", 304), validators, max_age)
+
+
+# Adds the validators and caching headers to a full response
+def add_validators(response, validators, max_age=60):
+    if validators is None:
+        response.cache_control.no_store = True
+        return response
+    response.set_etag(validators.etag)
+    if validators.last_modified is not None:
+        response.last_modified = validators.last_modified
+    if validators.public:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        # The browser can keep its copy but has to check it with us every time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
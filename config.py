@@ -17,3 +17,118 @@ class Config:
     # Session configuration is vulnerable to session hijacking and fixation attacks
     # Sessions should last for maybe 30 minutes to an hour for security purposes, not a whole month
     PERMANENT_SESSION_LIFETIME = timedelta(days=31)
+
+    # TMDB response cache - how long each kind of TMDB response stays cached (in seconds)
+    TMDB_CACHE_TTL = {
+        "trending": 10 * 60,
+        "search": 5 * 60,
+        "movie": 60 * 60,
+    }
+    # Upper bounds for the response cache before least recently used entries are evicted
+    TMDB_CACHE_MAX_ENTRIES = 2048
+    TMDB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # "memory" keeps TMDB responses in each worker process, "sqlite" shares one cache file
+    # between every worker on the machine so each response is only fetched once per machine
+    TMDB_CACHE_BACKEND = "memory"
+    SHARED_CACHE_PATH = 'instance/shared_cache.db'
+
+    # TMDB HTTP client - connection pool size, timeouts (in seconds) and retry budget
+    TMDB_POOL_SIZE = 20
+    TMDB_CONNECT_TIMEOUT = 3.05
+    TMDB_READ_TIMEOUT = 10
+    TMDB_MAX_RETRIES = 2
+    TMDB_RETRY_BACKOFF = 0.3
+
+    # How often (in seconds) the trending movies list is refreshed in the background
+    TRENDING_REFRESH_INTERVAL = 5 * 60
+
+    # Raw sqlite3 connections used by the routes
+    SQLITE_PATH = 'instance/cinefiles.db'
+    # How long (in milliseconds) a query waits for a lock before giving up
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_SYNCHRONOUS = "NORMAL"
+    # Page cache size in KiB (negative means KiB in SQLite) and memory mapped I/O size in bytes
+    SQLITE_CACHE_SIZE = -16000
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+    # How many reviews and comments are shown per page on the movie page
+    MOVIE_PAGE_SIZE = 20
+
+    # Most results the local search index returns for one query - also the size of a page of local results
+    SEARCH_LOCAL_LIMIT = 20
+    # TMDB serves at most this many pages of results for a search
+    SEARCH_MAX_PAGES = 500
+    # Threads prefetching the next page of TMDB search results - kept apart from TMDB_FETCH_WORKERS -
+    # and the most prefetches running or waiting for one of them, past which a prefetch is skipped
+    SEARCH_PREFETCH_WORKERS = 2
+    SEARCH_PREFETCH_MAX = 4
+    # Search as you type (/api/suggest) - most suggestions for one query, and how often (seconds)
+    # the in-memory title index picks up movies other processes added to the catalog
+    SUGGEST_LIMIT = 10
+    SUGGEST_REFRESH_INTERVAL = 5.0
+
+    # Poster image proxy - where images are cached on disk and how much space they can use
+    POSTER_CACHE_DIR = 'instance/posters'
+    POSTER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # Poster sizes TMDB offers that /poster will serve, and the ones offered in srcset
+    POSTER_SIZES = ["w92", "w154", "w185", "w342", "w500", "w780", "original"]
+    POSTER_SRCSET_SIZES = ["w185", "w342", "w500", "w780"]
+
+    # Rendered template fragments - default lifetime in seconds and size limits
+    FRAGMENT_CACHE_TTL = 10 * 60
+    FRAGMENT_CACHE_MAX_ENTRIES = 1024
+    FRAGMENT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+    # How long (in seconds) a CDN or proxy may reuse an anonymous home or movie page
+    PAGE_CACHE_MAX_AGE = 60
+
+    # Response compression - responses smaller than this (in bytes) are sent as they are
+    COMPRESS_MIN_SIZE = 500
+    # gzip level 1-9 (brotli quality is worked out from it)
+    COMPRESS_LEVEL = 6
+
+    # How many "because you rated" recommendations the profile page shows
+    RECOMMENDATIONS_PER_PAGE = 10
+
+    # JSON API - most movie ids one /api/movies request can ask for
+    API_MAX_IDS = 50
+    # Threads used to fetch movies that aren't cached from TMDB at the same time
+    TMDB_FETCH_WORKERS = 8
+    # Longest (in seconds) the movie page waits for TMDB before showing the saved details instead
+    MOVIE_TMDB_DEADLINE = 1.5
+    # Connections the async TMDB client (asgi.py) keeps open - it can wait on many more requests than threads
+    TMDB_ASYNC_POOL_SIZE = 100
+    # Most pages the async serving mode renders at once, each on a thread of its own
+    ASGI_RENDER_THREADS = 32
+
+    # Circuit breaker around TMDB - opens when too many of the last TMDB_BREAKER_WINDOW calls failed
+    # or took longer than TMDB_BREAKER_SLOW_CALL seconds, then fails fast for TMDB_BREAKER_OPEN_SECONDS
+    # before letting TMDB_BREAKER_HALF_OPEN_CALLS probe calls through
+    TMDB_BREAKER_WINDOW = 20
+    TMDB_BREAKER_MIN_CALLS = 10
+    TMDB_BREAKER_FAILURE_RATE = 0.5
+    TMDB_BREAKER_SLOW_CALL = 2.0
+    TMDB_BREAKER_SLOW_RATE = 0.5
+    TMDB_BREAKER_OPEN_SECONDS = 30
+    TMDB_BREAKER_HALF_OPEN_CALLS = 3
+
+    # Outgoing TMDB rate limit for each worker process - divide TMDB's quota by the number of workers
+    # Calls per second, and how many can be made at once after a quiet spell
+    TMDB_RATE_LIMIT = 20
+    TMDB_RATE_BURST = 20
+    # Longest (in seconds) each kind of call waits for quota before falling back to cached data
+    # The trending refresh is served first, then pages, then search, then prefetches - which never wait
+    TMDB_RATE_MAX_WAIT = {
+        "background": 10.0,
+        "page": 1.0,
+        "search": 0.25,
+        "prefetch": 0.0,
+    }
+    # Tokens each kind of call must leave in the bucket - prefetches only run while there is plenty of quota,
+    # so a page someone is waiting for never runs short because of a page nobody has asked for yet
+    TMDB_RATE_RESERVE = {
+        "prefetch": 10,
+    }
+
+    # How many of the top trending movies wsgi.py loads into the cache before the server takes traffic
+    WARM_MOVIE_COUNT = 20
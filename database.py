@@ -0,0 +1,75 @@
+# Import statements
+# sqlite3 for the raw sql queries used by the routes
+import sqlite3
+# threading.local gives each background thread its own connection
+import threading
+# g stores the connection for the current request, current_app gives us the config
+from flask import g, current_app
+
+
+# Opens a new connection to the SQLite database and tunes it
+# WAL journaling lets readers keep reading while a review or comment is being written
+# busy_timeout makes writers wait for a lock instead of failing with "database is locked"
+def connect(path, busy_timeout=5000, synchronous="NORMAL", cache_size=-16000, mmap_size=256 * 1024 * 1024):
+    conn = sqlite3.connect(path, timeout=busy_timeout / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+    # NORMAL is safe with WAL and avoids an fsync on every commit
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size={int(cache_size)}")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    return conn
+
+
+# Opens a connection using the settings in the app config
+def connect_from_config(config):
+    return connect(
+        config["SQLITE_PATH"],
+        busy_timeout=config["SQLITE_BUSY_TIMEOUT"],
+        synchronous=config["SQLITE_SYNCHRONOUS"],
+        cache_size=config["SQLITE_CACHE_SIZE"],
+        mmap_size=config["SQLITE_MMAP_SIZE"],
+    )
+
+
+# Connections for code that runs outside a request, such as background threads
+_thread_connections = threading.local()
+
+
+# Returns a connection owned by the current thread, opening it the first time it is needed
+# Used for writes that must not commit the current request's transaction
+def get_thread_db(config):
+    conn = getattr(_thread_connections, "conn", None)
+    if conn is None:
+        conn = _thread_connections.conn = connect_from_config(config)
+    return conn
+
+
+# Closes the current thread's connection, if it has one
+# Called before forking worker processes - a SQLite connection must never be shared by two processes
+def close_thread_db():
+    conn = getattr(_thread_connections, "conn", None)
+    if conn is not None:
+        _thread_connections.conn = None
+        conn.close()
+
+
+# Returns the connection for the current request, opening it the first time it is needed
+# Every query in the same request reuses this one connection
+def get_db():
+    if "db_conn" not in g:
+        g.db_conn = connect_from_config(current_app.config)
+    return g.db_conn
+
+
+# Closes the request's connection - runs at the end of every request even if it failed
+def close_db(error=None):
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
+
+# Registers the teardown so connections are never leaked
+def init_app(app):
+    app.teardown_appcontext(close_db)
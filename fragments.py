@@ -0,0 +1,44 @@
+# Import statements
+# Jinja's extension API lets us add a new {% cache %} tag to the templates
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+# Template fragment cache
+# Wrapping part of a template in {% cache key, ttl %} ... {% endcache %} stores the rendered HTML
+# and reuses it until the ttl (in seconds) runs out or the key changes
+# Put a data version in the key so the fragment is rebuilt as soon as the data is refreshed
+# A key of None turns caching off for that render
+#
+# The store is pluggable - anything with get(key) and set(key, value, ttl=...) works,
+# such as cache.TTLCache - and is set on the environment as fragment_cache
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_prefix="fragment:")
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        # The ttl is optional - without it the store's default is used
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render_cached", args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key, ttl, caller):
+        store = self.environment.fragment_cache
+        if store is None or key is None:
+            return caller()
+        if isinstance(key, (list, tuple)):
+            key = ":".join(str(part) for part in key)
+        key = f"{self.environment.fragment_cache_prefix}{key}"
+        html = store.get(key)
+        if html is None:
+            html = caller()
+            store.set(key, html, ttl=ttl)
+        return html
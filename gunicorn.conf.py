@@ -0,0 +1,12 @@
+# gunicorn settings for production - gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+bind = os.environ.get("CINEFILES_BIND", "0.0.0.0:8000")
+# Load the app (and warm its caches) once in the master before forking the workers
+preload_app = True
+workers = int(os.environ.get("CINEFILES_WORKERS", "2"))
+# Threads let a worker keep serving pages while other requests wait on TMDB
+worker_class = "gthread"
+threads = int(os.environ.get("CINEFILES_THREADS", "8"))
+# Longer than the slowest TMDB call with retries
+timeout = 60
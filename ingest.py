@@ -0,0 +1,127 @@
+# Import statements
+# click is used for the "flask ingest-catalog" command
+import click
+# gzip and json are used to read TMDB's export files one line at a time
+import gzip
+import json
+import os
+import time
+from flask import current_app
+from flask.cli import with_appcontext
+
+import database
+import migrations
+import search_index
+
+
+# Opens a JSONL file for reading text - gzip files are decompressed as they are read
+def _open_lines(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+# Reads the checkpoint file - maps each file path to how many lines have already been loaded
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Writes the checkpoint file atomically so a crash can never leave it half written
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+# Full details dumps have fields that the daily ID exports don't
+def _is_details_payload(movie):
+    return "genres" in movie or "credits" in movie
+
+
+# Loads one JSONL file into the catalog
+# Only one batch of lines is held in memory at a time and each batch is committed in its own transaction
+# Lines that were already loaded (according to the checkpoint) are skipped
+# progress is called with (file path, lines done, rows loaded) after every batch
+# Returns (lines read, rows loaded, bad lines skipped)
+def ingest_file(conn, path, batch_size=5000, checkpoint=None, checkpoint_path=None, progress=None):
+    checkpoint = {} if checkpoint is None else checkpoint
+    start_line = checkpoint.get(path, 0)
+    line_number = 0
+    loaded = 0
+    bad = 0
+    batch = []
+
+    def flush():
+        nonlocal loaded
+        with conn:
+            loaded += search_index.upsert_movies(conn, batch)
+            search_index.store_payloads(conn, [movie for movie in batch if _is_details_payload(movie)])
+        batch.clear()
+        # The checkpoint is only moved on once the batch has been committed
+        checkpoint[path] = line_number
+        save_checkpoint(checkpoint_path, checkpoint)
+        if progress:
+            progress(path, line_number, loaded)
+
+    with _open_lines(path) as lines:
+        for line_number, line in enumerate(lines, start=1):
+            if line_number <= start_line:
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                movie = json.loads(line)
+            except ValueError:
+                bad += 1
+                continue
+            if not isinstance(movie, dict) or movie.get("id") is None:
+                bad += 1
+                continue
+            batch.append(movie)
+            if len(batch) >= batch_size:
+                flush()
+    if batch or line_number > start_line:
+        flush()
+    return line_number, loaded, bad
+
+
+# CLI command: flask --app app ingest-catalog movie_ids_10_17_2026.json.gz details.jsonl.gz
+@click.command("ingest-catalog")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=5000, show_default=True, help="Rows per transaction.")
+@click.option("--checkpoint", "checkpoint_path", default="instance/ingest_checkpoint.json", show_default=True,
+              help="File used to resume an interrupted load.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and load every file from the start.")
+@with_appcontext
+def ingest_catalog_command(paths, batch_size, checkpoint_path, restart):
+    """Load movies from TMDB-style JSONL exports into the local catalog."""
+    # A fresh node may not have the catalog tables yet
+    migrations.setup_schema(current_app)
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    conn = database.connect_from_config(current_app.config)
+    started = time.perf_counter()
+    total_loaded = 0
+
+    def progress(path, lines_done, loaded):
+        elapsed = time.perf_counter() - started
+        rate = (total_loaded + loaded) / elapsed if elapsed else 0
+        click.echo(f"{path}: line {lines_done}, {loaded} rows loaded ({rate:,.0f} rows/s)")
+
+    try:
+        for path in paths:
+            lines, loaded, bad = ingest_file(conn, path, batch_size=batch_size, checkpoint=checkpoint,
+                                             checkpoint_path=checkpoint_path, progress=progress)
+            total_loaded += loaded
+            click.echo(f"Finished {path}: {lines} lines, {loaded} rows loaded, {bad} bad lines skipped")
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    rate = total_loaded / elapsed if elapsed else 0
+    click.echo(f"Loaded {total_loaded} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
@@ -0,0 +1,173 @@
+# Import statements
+# click is used for the "flask migrate" command
+import click
+# current_app gives the command access to the config
+from flask import current_app
+from flask.cli import with_appcontext
+import time
+
+import database
+from models import db
+
+
+# Every schema change, in the order it has to be applied
+# Each one is (version, name, list of SQL statements) - never edit one that has shipped, add a new one
+MIGRATIONS = [
+    (1, "review_movie_lookup_index", [
+        # movie_details looks reviews up by movie and lists them in date order
+        "CREATE INDEX IF NOT EXISTS ix_review_movie_id_timestamp ON review (movie_id, timestamp, id)",
+    ]),
+    (2, "comment_post_lookup_index", [
+        # movie_details looks comments up by post_id (the movie id) and lists them in date order
+        "CREATE INDEX IF NOT EXISTS ix_comment_post_id_timestamp ON comment (post_id, timestamp, id)",
+    ]),
+    (3, "review_comment_timestamps", [
+        # The raw sqlite3 inserts in app.py skip SQLAlchemy, so its timestamp default never ran
+        # Pagination orders by timestamp, so backfill the missing ones and fill them in on insert
+        "UPDATE review SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL",
+        "UPDATE comment SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL",
+        "CREATE TRIGGER IF NOT EXISTS review_default_timestamp AFTER INSERT ON review "
+        "WHEN NEW.timestamp IS NULL BEGIN "
+        "UPDATE review SET timestamp = CURRENT_TIMESTAMP WHERE id = NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS comment_default_timestamp AFTER INSERT ON comment "
+        "WHEN NEW.timestamp IS NULL BEGIN "
+        "UPDATE comment SET timestamp = CURRENT_TIMESTAMP WHERE id = NEW.id; END",
+    ]),
+    (4, "movie_rating_aggregates", [
+        # One row per reviewed movie with its review count, rating total and a 1-10 histogram
+        # Kept up to date by add_review - see ratings.py
+        "CREATE TABLE IF NOT EXISTS movie_rating ("
+        "movie_id INTEGER PRIMARY KEY, "
+        "review_count INTEGER NOT NULL DEFAULT 0, "
+        "rating_sum REAL NOT NULL DEFAULT 0, "
+        + ", ".join(f"count_{score} INTEGER NOT NULL DEFAULT 0" for score in range(1, 11))
+        + ")",
+        # Fill it in from the reviews that already exist
+        "INSERT OR REPLACE INTO movie_rating (movie_id, review_count, rating_sum, "
+        + ", ".join(f"count_{score}" for score in range(1, 11)) + ") "
+        "SELECT movie_id, COUNT(*), SUM(rating), "
+        + ", ".join(f"SUM(CAST(ROUND(rating) AS INTEGER) = {score})" for score in range(1, 11))
+        + " FROM review WHERE typeof(rating) IN ('integer', 'real') GROUP BY movie_id",
+    ]),
+    (5, "movie_catalog_search_index", [
+        # Local copy of every movie the app has seen from TMDB - see search_index.py
+        "CREATE TABLE IF NOT EXISTS movie_catalog ("
+        "id INTEGER PRIMARY KEY, title TEXT NOT NULL, original_title TEXT, overview TEXT, "
+        "release_date TEXT, poster_path TEXT, popularity REAL, vote_average REAL, vote_count INTEGER, "
+        "updated_at REAL NOT NULL)",
+        # Full text index over the titles and overviews, reading its content from movie_catalog
+        "CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5("
+        "title, overview, content='movie_catalog', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        # Triggers keep the full text index in step with the catalog
+        "CREATE TRIGGER IF NOT EXISTS movie_catalog_ai AFTER INSERT ON movie_catalog BEGIN "
+        "INSERT INTO movie_fts (rowid, title, overview) VALUES (new.id, new.title, new.overview); END",
+        "CREATE TRIGGER IF NOT EXISTS movie_catalog_ad AFTER DELETE ON movie_catalog BEGIN "
+        "INSERT INTO movie_fts (movie_fts, rowid, title, overview) VALUES ('delete', old.id, old.title, old.overview); END",
+        "CREATE TRIGGER IF NOT EXISTS movie_catalog_au AFTER UPDATE OF title, overview ON movie_catalog BEGIN "
+        "INSERT INTO movie_fts (movie_fts, rowid, title, overview) VALUES ('delete', old.id, old.title, old.overview); "
+        "INSERT INTO movie_fts (rowid, title, overview) VALUES (new.id, new.title, new.overview); END",
+    ]),
+    (6, "movie_payloads", [
+        # Full TMDB details payloads loaded by "flask ingest-catalog" so movie pages work offline
+        "CREATE TABLE IF NOT EXISTS movie_payload ("
+        "id INTEGER PRIMARY KEY, payload TEXT NOT NULL, updated_at REAL NOT NULL)",
+        # The most popular catalog movies stand in for the trending list when TMDB can't be reached
+        "CREATE INDEX IF NOT EXISTS ix_movie_catalog_popularity ON movie_catalog (popularity)",
+    ]),
+    (7, "movie_neighbours", [
+        # Precomputed item-item similarities written by "flask build-recommendations" - see recommend.py
+        "CREATE TABLE IF NOT EXISTS movie_neighbour ("
+        "movie_id INTEGER NOT NULL, neighbour_id INTEGER NOT NULL, score REAL NOT NULL, "
+        "PRIMARY KEY (movie_id, neighbour_id))",
+        # The profile page looks up the movies a user rated
+        "CREATE INDEX IF NOT EXISTS ix_review_user_id ON review (user_id, rating)",
+    ]),
+    (8, "movie_catalog_updated_at_index", [
+        # The search as you type index (suggest.py) picks up movies added by other processes by updated_at
+        "CREATE INDEX IF NOT EXISTS ix_movie_catalog_updated_at ON movie_catalog (updated_at)",
+    ]),
+    (9, "movie_catalog_change_seq", [
+        # updated_at is read from the clock before the write commits, so a row can be committed after
+        # a newer one and be missed by anything that only reads past the newest timestamp it has seen
+        # change_seq is handed out inside the write transaction, and SQLite has one writer at a time,
+        # so it only goes up in the order rows are committed
+        "ALTER TABLE movie_catalog ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS ix_movie_catalog_change_seq ON movie_catalog (change_seq)",
+    ]),
+]
+
+
+# Creates the table that records which migrations have already run
+def _ensure_migrations_table(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at REAL NOT NULL)"
+    )
+
+
+# Returns the highest migration version applied to the database (0 if none)
+def current_version(conn):
+    _ensure_migrations_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+# Applies every migration newer than the database's current version
+# Each migration runs in its own transaction so a failure leaves the database at the last good version
+# Returns the list of (version, name) pairs that were applied
+def migrate(conn, migrations=MIGRATIONS):
+    version = current_version(conn)
+    applied = []
+    # sqlite3 only opens transactions by itself for INSERT/UPDATE/DELETE, so CREATE and ALTER statements
+    # would each commit on their own - the transactions are opened and closed by hand instead
+    if conn.in_transaction:
+        conn.commit()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for number, name, statements in sorted(migrations):
+            if number <= version:
+                continue
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                    (number, name, time.time()),
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            applied.append((number, name))
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+# Opens a connection from the app config and brings the schema up to date
+def migrate_app(app):
+    conn = database.connect_from_config(app.config)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+# Creates the base tables and applies any pending migrations - needs an app context
+def setup_schema(app):
+    db.create_all()
+    return migrate_app(app)
+
+
+# CLI command: flask --app app migrate
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Apply any pending schema migrations to the database."""
+    applied = setup_schema(current_app)
+    for number, name in applied:
+        click.echo(f"Applied migration {number}: {name}")
+    if not applied:
+        click.echo("Database schema is up to date.")
@@ -45,6 +45,8 @@ class User(db.Model):
         comment = db.Column(db.Text, nullable=True)
         user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
         timestamp = db.Column(db.DateTime, index=True, default=db.func.now())
+        # Index for looking up a movie's reviews in date order - also created by migrations.py
+        __table_args__ = (db.Index('ix_review_movie_id_timestamp', 'movie_id', 'timestamp', 'id'),)
 
         # Method to add a review to the database
         # Unsanitised user input - SQL Injection vulnerability
@@ -67,6 +69,8 @@ class User(db.Model):
         user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
         content = db.Column(db.Text, nullable=False)
         timestamp = db.Column(db.DateTime, index=True, default=db.func.now())
+        # Index for looking up a movie's comments in date order - also created by migrations.py
+        __table_args__ = (db.Index('ix_comment_post_id_timestamp', 'post_id', 'timestamp', 'id'),)
 
     class Reply(db.Model):
         id = db.Column(db.Integer, primary_key=True)
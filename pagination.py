@@ -0,0 +1,82 @@
+# Import statements
+# base64 keeps cursors short and safe to put in a URL
+import base64
+
+
+# Turns the (timestamp, id) of the last row on a page into an opaque cursor string
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp or ''}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+# Turns a cursor back into (timestamp, id) - returns None for a missing or broken cursor
+# so a bad cursor in the URL just shows the first page
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# Keyset (cursor) pagination over rows ordered by (timestamp, id)
+# Instead of OFFSET, which has to walk every skipped row, this jumps straight to the rows after
+# the cursor using the (parent id, timestamp, id) index, so every page costs the same
+#
+# select - SELECT ... FROM ... JOIN ... part of the query
+# where - condition for the parent, such as "review.movie_id = ?"
+# timestamp_col and id_col - the columns the rows are ordered by
+# The select must return the timestamp and the id as its last two columns
+# Returns (rows, next_cursor) where next_cursor is None on the last page
+def keyset_page(conn, select, where, params, timestamp_col, id_col, after=None, page_size=20):
+    params = list(params)
+    position = decode_cursor(after)
+    if position is not None:
+        # Row value comparison matches the index order exactly
+        where = f"{where} AND ({timestamp_col}, {id_col}) > (?, ?)"
+        params.extend(position)
+    query = f"{select} WHERE {where} ORDER BY {timestamp_col}, {id_col} LIMIT ?"
+    # Ask for one extra row to find out if there is another page
+    params.append(page_size + 1)
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+    return rows, next_cursor
+
+
+# The first keyset page for many parents at once, such as the first reviews of 50 movies
+# One IN (...) query with ROW_NUMBER() instead of one keyset_page() query per parent
+#
+# columns - the selected columns, the last two must be the timestamp and the id like keyset_page()
+# tables - FROM ... JOIN ... part of the query
+# parent_col - column the rows belong to, such as "review.movie_id"
+# Returns a dict of parent id -> (rows, next_cursor), parents without rows are left out
+# The cursors carry on with keyset_page() for that parent
+def first_pages(conn, columns, tables, parent_col, parent_ids, timestamp_col, id_col, page_size=20):
+    parent_ids = list(parent_ids)
+    if not parent_ids:
+        return {}
+    query = (
+        f"SELECT * FROM (SELECT {parent_col} AS parent_id, {columns}, "
+        f"ROW_NUMBER() OVER (PARTITION BY {parent_col} ORDER BY {timestamp_col}, {id_col}) AS position "
+        f"FROM {tables} WHERE {parent_col} IN ({', '.join('?' * len(parent_ids))})) "
+        "WHERE position <= ? ORDER BY parent_id, position"
+    )
+    # One extra row per parent tells us if it has another page
+    rows = conn.execute(query, parent_ids + [page_size + 1]).fetchall()
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[0], []).append(row[1:-1])
+    pages = {}
+    for parent_id, parent_rows in grouped.items():
+        next_cursor = None
+        if len(parent_rows) > page_size:
+            parent_rows = parent_rows[:page_size]
+            next_cursor = encode_cursor(parent_rows[-1][-2], parent_rows[-1][-1])
+        pages[parent_id] = (parent_rows, next_cursor)
+    return pages
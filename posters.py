@@ -0,0 +1,180 @@
+# Import statements
+# hashlib gives us content hashes for file names and ETags
+import hashlib
+import os
+import re
+import threading
+import time
+
+from cache import SingleFlight
+
+
+# Poster paths from TMDB look like "abc123XYZ.jpg" - anything else is refused
+POSTER_PATH_PATTERN = re.compile(r"^[A-Za-z0-9_-]+\.(jpg|jpeg|png|webp|svg)$")
+
+# Eviction deletes blobs until the cache is down to this fraction of its cap
+EVICT_TO = 0.9
+# How often (seconds) the running totals are checked against the directory, to pick up what other
+# worker processes wrote or deleted
+RECONCILE_INTERVAL = 60
+
+MIMETYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+}
+
+
+# Works out the content type for a poster path
+def mimetype_for(path):
+    return MIMETYPES[path.rsplit(".", 1)[1].lower()]
+
+
+# On-disk cache for poster images
+# Image bytes are stored once under the SHA-256 of their content (content addressed) in blobs/
+# and a small ref file in refs/ maps each (size, path) to the hash it points at
+# When the blobs take up more than max_bytes the least recently used ones are deleted, along with their refs
+# Usage is kept as a running total, and measured from the directory at startup, every RECONCILE_INTERVAL
+# seconds and before evicting, so every worker process sharing it keeps to the one cap
+# without listing the directory on every download
+class PosterCache:
+    def __init__(self, directory, max_bytes, fetch):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # fetch(size, path) returns the image bytes from TMDB
+        self.fetch = fetch
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.ref_dir = os.path.join(directory, "refs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.ref_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        # Running totals for the blobs - bytes and how many
+        self._bytes = 0
+        self._count = 0
+        self._reconciled = 0.0
+        with self._lock:
+            self._reconcile()
+
+    # Returns (digest, file path) for a poster, downloading it the first time it is asked for
+    # The digest doubles as a strong ETag because it changes whenever the bytes do
+    def get(self, size, path):
+        ref_path = os.path.join(self.ref_dir, hashlib.sha1(f"{size}/{path}".encode()).hexdigest())
+        digest = self._read_ref(ref_path)
+        if digest is not None:
+            blob_path = os.path.join(self.blob_dir, digest)
+            if os.path.exists(blob_path):
+                # Touch the file so eviction knows it was used recently
+                try:
+                    os.utime(blob_path)
+                except OSError:
+                    pass
+                return digest, blob_path
+        # Only one thread downloads any given poster at a time
+        return self._flight.do(ref_path, lambda: self._download(size, path, ref_path))
+
+    def _read_ref(self, ref_path):
+        try:
+            with open(ref_path, "r", encoding="ascii") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _download(self, size, path, ref_path):
+        content = self.fetch(size, path)
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = os.path.join(self.blob_dir, digest)
+        # Identical images for different sizes or paths share one blob
+        if not os.path.exists(blob_path):
+            self._write_atomic(blob_path, content)
+            with self._lock:
+                self._bytes += len(content)
+                self._count += 1
+        self._write_atomic(ref_path, digest.encode("ascii"))
+        self._evict(keep=digest)
+        return digest, blob_path
+
+    # Writes to a temp file first so a half written image is never served
+    def _write_atomic(self, target, content):
+        # Thread idents repeat between worker processes, so the process id is part of the name too
+        temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, target)
+
+    # (mtime, size, path, name) of every blob, least recently used first
+    def _blobs(self):
+        blobs = []
+        for entry in os.scandir(self.blob_dir):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Deleted by another worker while we were looking
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+        return sorted(blobs)
+
+    # Sets the running totals from the directory - returns the blobs it found
+    # Must be called with the lock held
+    def _reconcile(self):
+        blobs = self._blobs()
+        self._bytes = sum(size for _, size, _, _ in blobs)
+        self._count = len(blobs)
+        self._reconciled = time.monotonic()
+        return blobs
+
+    # Must be called with the lock held
+    def _reconcile_if_due(self):
+        if time.monotonic() - self._reconciled >= RECONCILE_INTERVAL:
+            self._reconcile()
+
+    # Deletes the least recently used blobs until the cache is under its size cap
+    # Goes down to EVICT_TO of the cap so eviction (and the scan of refs it needs) happens in batches
+    def _evict(self, keep=None):
+        with self._lock:
+            self._reconcile_if_due()
+            if self._bytes <= self.max_bytes:
+                return
+            # Over the cap going by the running total - the directory says exactly what there is to delete
+            blobs = self._reconcile()
+            used = self._bytes
+            if used <= self.max_bytes:
+                return
+            evicted = set()
+            for _, size, blob_path, name in blobs:
+                if used <= self.max_bytes * EVICT_TO:
+                    break
+                if name == keep:
+                    continue
+                try:
+                    os.remove(blob_path)
+                except OSError:
+                    continue
+                used -= size
+                evicted.add(name)
+            self._bytes = used
+            self._count -= len(evicted)
+            self._remove_refs(evicted)
+
+    # Deletes the refs that point at any of the given blobs
+    def _remove_refs(self, digests):
+        if not digests:
+            return
+        for entry in os.scandir(self.ref_dir):
+            if entry.name.endswith(".tmp"):
+                continue
+            if self._read_ref(entry.path) in digests:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    # Information for monitoring
+    def stats(self):
+        with self._lock:
+            self._reconcile_if_due()
+            return {"blobs": self._count, "bytes": self._bytes, "max_bytes": self.max_bytes}
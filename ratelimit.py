@@ -0,0 +1,143 @@
+# Import statements
+# asyncio lets the async serving mode wait for a token without blocking the event loop
+import asyncio
+# heapq keeps the requests waiting for a token in priority order
+import heapq
+import itertools
+import threading
+import time
+
+# RateLimitedError is a requests error so every route that already copes with TMDB failing
+# copes with running out of quota too, by serving cached data
+import requests
+
+
+# Priority classes from most to least important
+# The trending refresh must never be starved, pages come next and search, the busiest, comes after them
+# Prefetches of pages nobody has asked for yet only get quota nothing else wants
+PRIORITIES = ("background", "page", "search", "prefetch")
+
+
+# Raised when a call can't get a token within its class's longest wait
+class RateLimitedError(requests.ConnectionError):
+    pass
+
+
+# Token bucket rate limiter for outgoing calls, with priority classes
+# Tokens are added at rate per second up to burst - every call takes one token
+# When calls have to wait, the most important class always gets the next token,
+# and a call gives up (RateLimitedError) rather than wait longer than max_wait[its class]
+# reserve[a class] is how many tokens must still be left after one of its calls - a class with a reserve
+# only gets spare quota, never the last few tokens the other classes may need
+# Shared by every thread in the process, and by the event loop in the async serving mode
+class PriorityRateLimiter:
+    def __init__(self, rate, burst, max_wait, reserve=None):
+        self.rate = rate
+        self.burst = burst
+        # priority class -> longest wait in seconds
+        self.max_wait = max_wait
+        # priority class -> tokens that must be left over
+        self.reserve = reserve or {}
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # (rank, sequence) of every waiting call - the smallest is first in line
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        # Counters for monitoring
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+
+    # Takes a token, waiting for one if needed
+    # Raises RateLimitedError straight away if the wait would clearly be too long, or once it has been
+    def acquire(self, priority):
+        with self._cond:
+            waiter, deadline = self._join(priority)
+            try:
+                while True:
+                    wait = self._try_take(waiter, priority, deadline)
+                    if wait is None:
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._leave(waiter)
+
+    # Same as acquire() for coroutines - waits with asyncio.sleep so the event loop is never blocked
+    async def acquire_async(self, priority):
+        with self._cond:
+            waiter, deadline = self._join(priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(waiter, priority, deadline)
+                if wait is None:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            with self._cond:
+                self._leave(waiter)
+
+    # Whether a call of this class would get a token straight away - for skipping optional work early
+    def has_spare(self, priority):
+        with self._cond:
+            self._refill()
+            return not self._waiters and self._tokens - 1 >= self.reserve.get(priority, 0)
+
+    # Information about the limiter for monitoring
+    def status(self):
+        with self._cond:
+            self._refill()
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "waiting": {priority: sum(1 for rank, _ in self._waiters if PRIORITIES[rank] == priority)
+                            for priority in PRIORITIES},
+                "granted": dict(self.granted),
+                "rejected": dict(self.rejected),
+            }
+
+    # Gets in line for a token - returns (waiter, deadline)
+    # Must be called with the lock held
+    def _join(self, priority):
+        self._refill()
+        waiter = (PRIORITIES.index(priority), next(self._sequence))
+        # Fail fast - every waiter ahead of us needs a token first
+        ahead = sum(1 for other in self._waiters if other < waiter)
+        if (ahead + 1 + self.reserve.get(priority, 0) - self._tokens) / self.rate > self.max_wait[priority]:
+            self.rejected[priority] += 1
+            raise RateLimitedError(f"no TMDB quota left for a {priority} call")
+        heapq.heappush(self._waiters, waiter)
+        return waiter, time.monotonic() + self.max_wait[priority]
+
+    # Takes a token if it is the waiter's turn and one is free - returns None if it did,
+    # otherwise how long to wait before trying again
+    # Must be called with the lock held
+    def _try_take(self, waiter, priority, deadline):
+        self._refill()
+        first = self._waiters[0] == waiter
+        needed = 1 + self.reserve.get(priority, 0)
+        if first and self._tokens >= needed:
+            self._tokens -= 1
+            self.granted[priority] += 1
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.rejected[priority] += 1
+            raise RateLimitedError(f"no TMDB quota left for a {priority} call")
+        # The first in line waits until its token is due, the rest check again when the next token is
+        if first:
+            return min(remaining, (needed - self._tokens) / self.rate)
+        return min(remaining, 1 / self.rate)
+
+    # Must be called with the lock held
+    def _leave(self, waiter):
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+        self._cond.notify_all()
+
+    # Must be called with the lock held
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
@@ -0,0 +1,134 @@
+# Import statements
+# click is used for the "flask rebuild-ratings" command
+import click
+import math
+from flask import current_app
+from flask.cli import with_appcontext
+
+import database
+
+
+# Names of the histogram columns in the movie_rating table - one per score from 1 to 10
+HISTOGRAM_COLUMNS = [f"count_{score}" for score in range(1, 11)]
+
+
+# Works out which histogram bucket a rating belongs in
+# Returns (value, bucket) - value is None if the rating is not a number
+# and bucket is None if it is outside 1 to 10
+def _classify(rating):
+    try:
+        value = float(rating)
+    except (TypeError, ValueError):
+        return None, None
+    if not math.isfinite(value):
+        return None, None
+    # Round halves up the same way SQLite's ROUND() does in the migration
+    bucket = math.floor(value + 0.5)
+    return value, bucket if 1 <= bucket <= 10 else None
+
+
+# Adds one review's rating to the movie's aggregate row
+# Does not commit - call it before the commit for the review insert so both land in the same transaction
+def record_rating(conn, movie_id, rating):
+    value, bucket = _classify(rating)
+    if value is None:
+        return
+    histogram = f", {HISTOGRAM_COLUMNS[bucket - 1]} = {HISTOGRAM_COLUMNS[bucket - 1]} + 1" if bucket else ""
+    conn.execute(
+        "INSERT INTO movie_rating (movie_id) VALUES (?) ON CONFLICT(movie_id) DO NOTHING",
+        (movie_id,),
+    )
+    conn.execute(
+        f"UPDATE movie_rating SET review_count = review_count + 1, rating_sum = rating_sum + ?{histogram} "
+        "WHERE movie_id = ?",
+        (value, movie_id),
+    )
+
+
+# Returns the aggregate for one movie as a dict, or None if nobody has reviewed it
+# A single primary key lookup no matter how many reviews the movie has
+def get_rating_summary(conn, movie_id):
+    row = conn.execute(
+        f"SELECT review_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)} FROM movie_rating WHERE movie_id = ?",
+        (movie_id,),
+    ).fetchone()
+    return _summary(row)
+
+
+# Aggregates for many movies in one IN (...) query
+# Returns a dict of movie id -> summary, movies nobody has reviewed are left out
+def get_rating_summaries(conn, movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT movie_id, review_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)} FROM movie_rating "
+        f"WHERE movie_id IN ({', '.join('?' * len(movie_ids))})",
+        movie_ids,
+    ).fetchall()
+    summaries = {row[0]: _summary(row[1:]) for row in rows}
+    return {movie_id: summary for movie_id, summary in summaries.items() if summary is not None}
+
+
+# Turns a (review_count, rating_sum, count_1 ... count_10) row into a summary dict
+def _summary(row):
+    if row is None or not row[0]:
+        return None
+    count, total = row[0], row[1]
+    return {
+        "count": count,
+        "average": round(total / count, 1),
+        # score -> number of reviews with that score
+        "histogram": {score: row[score + 1] for score in range(1, 11)},
+    }
+
+
+# Recomputes every movie's aggregate from the review table in one streaming pass
+# Reviews are read in movie_id order (using the review index) so only one movie is held in memory at a time
+# Returns how many movies were written
+def rebuild_ratings(conn, batch_size=1000):
+    columns = ["movie_id", "review_count", "rating_sum"] + HISTOGRAM_COLUMNS
+    insert = f"INSERT INTO movie_rating ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    written = 0
+    batch = []
+    current = None
+
+    def finish(row):
+        nonlocal written
+        if row is not None and row[1]:
+            batch.append(row)
+            written += 1
+        if len(batch) >= batch_size:
+            conn.executemany(insert, batch)
+            batch.clear()
+
+    with conn:
+        conn.execute("DELETE FROM movie_rating")
+        for movie_id, rating in conn.execute("SELECT movie_id, rating FROM review ORDER BY movie_id"):
+            if current is None or current[0] != movie_id:
+                finish(current)
+                current = [movie_id, 0, 0.0] + [0] * 10
+            value, bucket = _classify(rating)
+            if value is None:
+                continue
+            current[1] += 1
+            current[2] += value
+            if bucket:
+                current[2 + bucket] += 1
+        finish(current)
+        if batch:
+            conn.executemany(insert, batch)
+    return written
+
+
+# CLI command: flask --app app rebuild-ratings
+@click.command("rebuild-ratings")
+@with_appcontext
+def rebuild_ratings_command():
+    """Recompute the per-movie rating aggregates from the review table."""
+    conn = database.connect_from_config(current_app.config)
+    try:
+        written = rebuild_ratings(conn)
+    finally:
+        conn.close()
+    click.echo(f"Rebuilt rating aggregates for {written} movies.")
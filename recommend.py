@@ -0,0 +1,175 @@
+# Import statements
+# click is used for the "flask build-recommendations" command
+import click
+import time
+from flask import current_app
+from flask.cli import with_appcontext
+
+import database
+import migrations
+
+# NumPy and SciPy are only needed to build the recommendations, not to show them
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+
+# Reads every (user_id, movie_id, rating) from the review table into NumPy arrays
+# Rows are streamed straight into one structured array so no Python list of millions of tuples is ever built
+def load_ratings(conn):
+    rows = conn.execute("SELECT user_id, movie_id, rating FROM review WHERE typeof(rating) IN ('integer', 'real')")
+    table = np.fromiter(rows, dtype=[("user_id", np.int64), ("movie_id", np.int64), ("rating", np.float32)])
+    return table["user_id"], table["movie_id"], table["rating"]
+
+
+# Builds the sparse user x movie matrix of mean-centred ratings (adjusted cosine)
+# Taking away each user's average rating stops generous and harsh reviewers skewing the similarities
+# A user who reviewed the same movie twice counts with the average of the two ratings
+# Returns (matrix, movie ids for each column)
+def build_matrix(users, movies, ratings):
+    user_ids, user_index = np.unique(users, return_inverse=True)
+    movie_ids, movie_index = np.unique(movies, return_inverse=True)
+    shape = (len(user_ids), len(movie_ids))
+    totals = sparse.coo_matrix((ratings, (user_index, movie_index)), shape=shape).tocsr()
+    counts = sparse.coo_matrix((np.ones_like(ratings), (user_index, movie_index)), shape=shape).tocsr()
+    matrix = totals.copy()
+    matrix.data = totals.data / counts.data
+    # Centre each user's ratings on their own average
+    per_user = np.diff(matrix.indptr)
+    means = np.asarray(matrix.sum(axis=1)).ravel() / np.maximum(per_user, 1)
+    matrix.data = matrix.data - np.repeat(means, per_user)
+    matrix.eliminate_zeros()
+    return matrix, movie_ids
+
+
+# The neighbour table is built under this name and renamed to movie_neighbour once it is complete
+# Same columns as movie_neighbour (migration 7)
+STAGING_TABLE = "movie_neighbour_staging"
+
+
+# Works out the top_k most similar movies for every movie with cosine similarity
+# Columns are normalised once and then multiplied a block of movies at a time, and each block's
+# neighbours are handed back before the next block is worked out, so memory is bounded by block_size
+# (a block's similarities can be dense - block_size x number of movies - so lower it for huge catalogues)
+# Yields a list of (movie_id, neighbour_id, score) for each block
+def top_k_neighbours(matrix, movie_ids, top_k=20, min_score=0.0, block_size=2048):
+    columns = matrix.tocsc()
+    norms = np.sqrt(np.asarray(columns.multiply(columns).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalised = (columns @ sparse.diags(1.0 / norms)).tocsc()
+    transposed = normalised.T.tocsr()
+    for start in range(0, normalised.shape[1], block_size):
+        stop = min(start + block_size, normalised.shape[1])
+        neighbours = []
+        # (block of movies) x (all movies) similarity, still sparse
+        block = (transposed[start:stop] @ normalised).tocsr()
+        for row in range(block.shape[0]):
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            cols = block.indices[begin:end]
+            scores = block.data[begin:end]
+            # A movie is not its own neighbour
+            keep = (cols != start + row) & (scores > min_score)
+            cols, scores = cols[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                cols, scores = cols[best], scores[best]
+            movie_id = int(movie_ids[start + row])
+            neighbours.extend((movie_id, int(movie_ids[col]), float(score)) for col, score in zip(cols, scores))
+        yield neighbours
+
+
+# Rebuilds the whole neighbour table from the review table
+# Each block of neighbours is written to a staging table as soon as it is worked out, then the staging table
+# replaces movie_neighbour in one transaction, so pages never see a half built index
+# Returns (number of movies, number of neighbour rows)
+def build_recommendations(conn, top_k=20, min_score=0.0, block_size=2048):
+    if np is None:
+        raise RuntimeError("NumPy and SciPy are needed to build recommendations")
+    users, movies, ratings = load_ratings(conn)
+    with conn:
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        conn.execute(
+            f"CREATE TABLE {STAGING_TABLE} ("
+            "movie_id INTEGER NOT NULL, neighbour_id INTEGER NOT NULL, score REAL NOT NULL, "
+            "PRIMARY KEY (movie_id, neighbour_id))"
+        )
+    movie_count = neighbour_count = 0
+    if len(ratings) > 0:
+        matrix, movie_ids = build_matrix(users, movies, ratings)
+        movie_count = len(movie_ids)
+        for neighbours in top_k_neighbours(matrix, movie_ids, top_k=top_k, min_score=min_score,
+                                           block_size=block_size):
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO {STAGING_TABLE} (movie_id, neighbour_id, score) VALUES (?, ?, ?)",
+                    neighbours,
+                )
+            neighbour_count += len(neighbours)
+    # sqlite3 doesn't start a transaction for DROP and ALTER on its own, so start one here -
+    # otherwise a page could run between the two and find no movie_neighbour table
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DROP TABLE movie_neighbour")
+        conn.execute(f"ALTER TABLE {STAGING_TABLE} RENAME TO movie_neighbour")
+    return movie_count, neighbour_count
+
+
+# "Because you rated X" recommendations for one user, read from the precomputed neighbour table
+# Starts from the movies the user rated highest and skips anything they have already reviewed
+# Returns a list of dicts with the recommended movie and the movie it is based on
+def recommendations_for_user(conn, user_id, limit=10, min_rating=7, per_movie=3):
+    rows = conn.execute(
+        "SELECT n.neighbour_id, COALESCE(rec.title, 'Movie #' || n.neighbour_id), rec.poster_path, "
+        "n.movie_id, COALESCE(src.title, 'Movie #' || n.movie_id), n.score "
+        "FROM (SELECT movie_id, MAX(rating) AS rating FROM review WHERE user_id = ? AND rating >= ? "
+        "      GROUP BY movie_id ORDER BY rating DESC LIMIT 20) AS liked "
+        "JOIN movie_neighbour AS n ON n.movie_id = liked.movie_id "
+        "LEFT JOIN movie_catalog AS rec ON rec.id = n.neighbour_id "
+        "LEFT JOIN movie_catalog AS src ON src.id = n.movie_id "
+        "WHERE n.neighbour_id NOT IN (SELECT movie_id FROM review WHERE user_id = ?) "
+        "ORDER BY liked.rating DESC, n.score DESC",
+        (user_id, min_rating, user_id),
+    ).fetchall()
+    picked = []
+    seen = set()
+    from_movie = {}
+    for movie_id, title, poster_path, because_id, because_title, score in rows:
+        if movie_id in seen or from_movie.get(because_id, 0) >= per_movie:
+            continue
+        seen.add(movie_id)
+        from_movie[because_id] = from_movie.get(because_id, 0) + 1
+        picked.append({
+            "id": movie_id,
+            "title": title,
+            "poster_path": poster_path,
+            "because_id": because_id,
+            "because_title": because_title,
+            "score": round(score, 3),
+        })
+        if len(picked) >= limit:
+            break
+    return picked
+
+
+# CLI command: flask --app app build-recommendations
+@click.command("build-recommendations")
+@click.option("--top-k", default=20, show_default=True, help="Neighbours kept for each movie.")
+@click.option("--min-score", default=0.0, show_default=True, help="Smallest similarity worth keeping.")
+@click.option("--block-size", default=2048, show_default=True,
+              help="Movies compared with the whole catalogue at a time - lower it to use less memory.")
+@with_appcontext
+def build_recommendations_command(top_k, min_score, block_size):
+    """Rebuild the item-item recommendation index from the review table."""
+    migrations.setup_schema(current_app)
+    conn = database.connect_from_config(current_app.config)
+    started = time.perf_counter()
+    try:
+        movie_count, neighbour_count = build_recommendations(conn, top_k=top_k, min_score=min_score,
+                                                              block_size=block_size)
+    finally:
+        conn.close()
+    click.echo(f"Stored {neighbour_count} neighbours for {movie_count} movies "
+               f"in {time.perf_counter() - started:.1f}s.")
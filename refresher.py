@@ -0,0 +1,99 @@
+# Import statements
+# logging is used to record background refreshes that fail
+import logging
+# hashlib and json are used to fingerprint the data so we can tell when it really changed
+import hashlib
+import json
+# threading is used to run the refresh loop in the background
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# Keeps the last good copy of some data and refreshes it on a timer in a background thread
+# Requests always get the last good copy straight away (stale-while-revalidate)
+# and only wait on the load function if there is no copy at all yet
+class BackgroundRefresher:
+    def __init__(self, name, load, interval):
+        self.name = name
+        self.load = load
+        self.interval = interval
+        self._data = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # When the data was last refreshed (unix time) and how long that took (seconds)
+        self.last_refreshed = None
+        self.last_duration = None
+        self.last_error = None
+        # Fingerprint of the current data - used to invalidate anything built from it
+        # and last_changed is when it last changed (unix time)
+        self.version = None
+        self.last_changed = None
+
+    # Returns the last good copy, loading it first if we have never had one
+    def get(self):
+        if self._data is None:
+            with self._lock:
+                # Another thread may have loaded it while we were waiting for the lock
+                if self._data is None:
+                    self.refresh()
+        self.start()
+        return self._data
+
+    # Loads a fresh copy now - on failure the old copy is kept and the error is raised
+    def refresh(self):
+        started = time.perf_counter()
+        try:
+            data = self.load()
+        except Exception as e:
+            self.last_error = repr(e)
+            raise
+        version = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        now = time.time()
+        if version != self.version:
+            self.last_changed = now
+        self._data = data
+        self.version = version
+        self.last_duration = time.perf_counter() - started
+        self.last_refreshed = now
+        self.last_error = None
+        return data
+
+    # Starts the background thread - safe to call more than once
+    # Started lazily so every worker process gets its own thread after forking
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"refresh-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # Information about the last refresh for monitoring
+    def status(self):
+        return {
+            "name": self.name,
+            "has_data": self._data is not None,
+            "version": self.version,
+            "last_changed": self.last_changed,
+            "last_refreshed": self.last_refreshed,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "interval": self.interval,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the last good copy and try again next time
+                logger.exception("Background refresh of %s failed", self.name)
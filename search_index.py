@@ -0,0 +1,162 @@
+# Import statements
+# logging is used when a payload can't be indexed - indexing must never break a page
+import logging
+# json is used to store full TMDB payloads
+import json
+# re is used to split search queries into words
+import re
+import sqlite3
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Columns kept for every movie in the local catalog
+CATALOG_COLUMNS = ["id", "title", "original_title", "overview", "release_date",
+                   "poster_path", "popularity", "vote_average", "vote_count"]
+
+
+# Pulls the movies out of a TMDB payload
+# List endpoints (trending, search) have a "results" list, the details endpoint is a single movie
+def movies_from_payload(data):
+    if not isinstance(data, dict):
+        return []
+    if isinstance(data.get("results"), list):
+        return [movie for movie in data["results"] if isinstance(movie, dict)]
+    if "id" in data and "title" in data:
+        return [data]
+    return []
+
+
+# Adds or updates movies in the local catalog - the FTS index is kept in step by triggers
+# Does not commit so callers can batch many calls into one transaction
+def upsert_movies(conn, movies):
+    rows = []
+    # Rows from TMDB's daily ID exports only have the original title
+    # It is used as the title for new movies but never replaces a title we already have
+    sparse_rows = []
+    now = time.time()
+    for movie in movies:
+        if movie.get("id") is None:
+            continue
+        if movie.get("title"):
+            rows.append([movie.get(column) for column in CATALOG_COLUMNS] + [now])
+        elif movie.get("original_title"):
+            sparse_rows.append([movie.get(column) for column in CATALOG_COLUMNS] + [now])
+            sparse_rows[-1][1] = movie["original_title"]
+    columns = CATALOG_COLUMNS + ["updated_at"]
+    # Every row written gets the next change_seq, so the suggest index can find everything written since it last looked
+    insert = (f"INSERT INTO movie_catalog ({', '.join(columns)}, change_seq) VALUES ({', '.join('?' * len(columns))}, "
+              "(SELECT COALESCE(MAX(change_seq), 0) + 1 FROM movie_catalog)) ")
+    # Missing values never overwrite ones we already have, so a sparse row
+    # doesn't wipe the overview that came from a full details payload
+    for batch, updated in ((rows, columns[1:]), (sparse_rows, [c for c in columns[1:] if c != "title"])):
+        if batch:
+            updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in updated)
+            updates += ", change_seq = excluded.change_seq"
+            conn.executemany(insert + f"ON CONFLICT(id) DO UPDATE SET {updates}", batch)
+    return len(rows) + len(sparse_rows)
+
+
+# Indexes every movie found in a TMDB payload and commits
+# Errors (such as the migration not having run yet) are logged and ignored
+def index_payload(conn, data):
+    try:
+        with conn:
+            return upsert_movies(conn, movies_from_payload(data))
+    except sqlite3.Error:
+        logger.exception("Could not index TMDB payload")
+        return 0
+
+
+# Turns what the user typed into a safe FTS5 query
+# Every word has to match, and the last word can be the start of a longer word
+def _match_expression(query):
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+# Searches the local catalog - titles count for more than overviews when ranking with bm25
+# Returns dicts shaped like TMDB search results so the same template can show them
+# offset skips that many results, for later pages
+def search(conn, query, limit=20, offset=0):
+    expression = _match_expression(query)
+    if expression is None:
+        return []
+    rows = conn.execute(
+        f"SELECT {', '.join('movie_catalog.' + column for column in CATALOG_COLUMNS)} "
+        "FROM movie_fts JOIN movie_catalog ON movie_catalog.id = movie_fts.rowid "
+        "WHERE movie_fts MATCH ? ORDER BY bm25(movie_fts, 10.0, 1.0), movie_catalog.id LIMIT ? OFFSET ?",
+        (expression, limit, offset),
+    ).fetchall()
+    return [dict(zip(CATALOG_COLUMNS, row)) for row in rows]
+
+
+# Combines local and TMDB results - local ones first, then TMDB ones we didn't already have
+def merge_results(local, remote):
+    seen = {movie["id"] for movie in local}
+    return local + [movie for movie in remote if movie.get("id") not in seen]
+
+
+# Stores full TMDB details payloads - does not commit
+def store_payloads(conn, payloads):
+    now = time.time()
+    rows = [(payload["id"], json.dumps(payload, separators=(",", ":")), now) for payload in payloads]
+    conn.executemany(
+        "INSERT INTO movie_payload (id, payload, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at",
+        rows,
+    )
+    return len(rows)
+
+
+# Returns the stored details payload for a movie, or None if it was never ingested
+def get_payload(conn, movie_id):
+    try:
+        row = conn.execute("SELECT payload FROM movie_payload WHERE id = ?", (movie_id,)).fetchone()
+    except sqlite3.Error:
+        logger.exception("Could not read stored payload for movie %s", movie_id)
+        return None
+    return json.loads(row[0]) if row else None
+
+
+# Returns the catalog row for a movie as a dict shaped like a TMDB result, or None if we have never seen it
+def get_movie(conn, movie_id):
+    try:
+        row = conn.execute(
+            f"SELECT {', '.join(CATALOG_COLUMNS)} FROM movie_catalog WHERE id = ?",
+            (movie_id,),
+        ).fetchone()
+    except sqlite3.Error:
+        logger.exception("Could not read catalog row for movie %s", movie_id)
+        return None
+    return dict(zip(CATALOG_COLUMNS, row)) if row else None
+
+
+# Stored details payloads for many movies in one IN (...) query
+# Returns a dict of movie id -> payload, movies that were never ingested are left out
+def get_payloads(conn, movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+    try:
+        rows = conn.execute(
+            f"SELECT id, payload FROM movie_payload WHERE id IN ({', '.join('?' * len(movie_ids))})",
+            movie_ids,
+        ).fetchall()
+    except sqlite3.Error:
+        logger.exception("Could not read stored payloads")
+        return {}
+    return {row[0]: json.loads(row[1]) for row in rows}
+
+
+# Returns the most popular movies in the catalog shaped like a TMDB trending response
+def top_movies(conn, limit=20):
+    rows = conn.execute(
+        f"SELECT {', '.join(CATALOG_COLUMNS)} FROM movie_catalog ORDER BY popularity DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return {"results": [dict(zip(CATALOG_COLUMNS, row)) for row in rows]}
@@ -0,0 +1,244 @@
+# Import statements
+# hashlib gives values stored without a version a version based on their content
+import hashlib
+# logging is used to record cache errors - a broken cache must never break a page
+import logging
+# marshal is the built in compact serializer, msgpack is used instead if it is installed
+import marshal
+import os
+# sqlite3 stores the cache in one file every worker process on the machine can use
+import sqlite3
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+# Every stored value starts with a byte saying how it was serialized,
+# so workers with and without msgpack can still read each other's entries
+_MARSHAL = b"m"
+_MSGPACK = b"p"
+
+# Reads only update an entry's last used time if it is older than this (seconds),
+# so popular keys don't turn every read into a write
+TOUCH_INTERVAL = 30
+# Expired entries are kept this long (seconds) as a last resort for get_stale()
+STALE_TTL = 24 * 60 * 60
+# Eviction runs at most this often (seconds) per process, so the limits can be briefly overshot
+EVICT_INTERVAL = 1.0
+
+
+def _dumps(value):
+    if msgpack is not None:
+        return _MSGPACK + msgpack.packb(value, use_bin_type=True)
+    return _MARSHAL + marshal.dumps(value)
+
+
+def _loads(blob):
+    blob = bytes(blob)
+    if blob[:1] == _MSGPACK:
+        if msgpack is None:
+            raise ValueError("value was stored with msgpack, which is not installed")
+        return msgpack.unpackb(blob[1:], raw=False, strict_map_key=False)
+    return marshal.loads(blob[1:])
+
+
+# Cache shared by every worker process on the machine, stored in a SQLite file
+# Works the same as TTLCache (get, set, info, version, delete, clear, stats) so it can be used in its place
+# Entries have a time to live and the least recently used ones are evicted when there are too many entries
+# or they take up too many bytes
+#
+# Values must be plain data - dicts, lists, strings, numbers, True/False/None - like TMDB's JSON
+class SQLiteCache:
+    def __init__(self, path, max_entries=1024, max_bytes=64 * 1024 * 1024, default_ttl=300, busy_timeout=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._last_evicted = 0.0
+        # Counters for this process so we can see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, version TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_used_at ON cache_entry (used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_expires_at ON cache_entry (expires_at)")
+
+    # One connection per thread, and a new one after a fork - SQLite connections can't be shared by processes
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # Returns the cached value or the default if the key is missing or has expired
+    def get(self, key, default=None):
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at, used_at FROM cache_entry WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            blob, expires_at, used_at = row
+            if expires_at <= now:
+                # Expired entries count as a miss but are kept for a while as a last resort for get_stale()
+                self.expirations += 1
+                self.misses += 1
+                return default
+            value = _loads(blob)
+            if now - used_at >= TOUCH_INTERVAL:
+                with conn:
+                    conn.execute("UPDATE cache_entry SET used_at = ? WHERE key = ?", (now, key))
+        except (sqlite3.Error, ValueError, EOFError, TypeError):
+            logger.exception("Shared cache read failed for %s", key)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    # Stores a value - ttl is in seconds
+    # size is accepted to match TTLCache, but the limit is on the stored bytes, which are measured exactly
+    # The version defaults to a hash of the stored bytes, so it is the same in every worker
+    def set(self, key, value, ttl=None, size=None, version=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            blob = _dumps(value)
+        except (ValueError, TypeError):
+            logger.exception("Value for %s can't be stored in the shared cache", key)
+            return
+        size = len(blob)
+        # Values bigger than the whole cache are not worth storing
+        if size > self.max_bytes:
+            return
+        if version is None:
+            version = hashlib.sha1(blob).hexdigest()[:16]
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entry (key, value, size, version, expires_at, stored_at, used_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, blob, size, str(version), now + ttl, now, now),
+                )
+            if now - self._last_evicted >= EVICT_INTERVAL:
+                self._last_evicted = now
+                self._evict(conn, now)
+        except sqlite3.Error:
+            logger.exception("Shared cache write failed for %s", key)
+
+    # Drops entries that expired more than STALE_TTL ago, then the least recently used ones
+    # until we are back under the limits
+    def _evict(self, conn, now):
+        with conn:
+            conn.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (now - STALE_TTL,))
+            count, total = conn.execute("SELECT COUNT(*), TOTAL(size) FROM cache_entry").fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM cache_entry ORDER BY used_at"):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                count -= 1
+                total -= size
+            conn.executemany("DELETE FROM cache_entry WHERE key = ?", victims)
+            self.evictions += len(victims)
+
+    # Returns (version, stored_at) for a live entry, or None if the key is missing or has expired
+    # stored_at is the unix time the value was set
+    # Does not count as a hit or a miss and does not change the LRU order
+    def info(self, key):
+        try:
+            row = self._connect().execute(
+                "SELECT version, stored_at FROM cache_entry WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            logger.exception("Shared cache read failed for %s", key)
+            return None
+        return (row[0], row[1]) if row else None
+
+    # Returns the version of a live entry, or None if the key is missing or has expired
+    def version(self, key):
+        info = self.info(key)
+        return info[0] if info else None
+
+    # Returns the value even if it has expired, or the default if it has been evicted
+    # A last resort for when the value can't be loaded again, such as when TMDB is down
+    # Does not count as a hit or a miss and does not change the LRU order
+    def get_stale(self, key, default=None):
+        try:
+            row = self._connect().execute("SELECT value FROM cache_entry WHERE key = ?", (key,)).fetchone()
+            return _loads(row[0]) if row else default
+        except (sqlite3.Error, ValueError, EOFError, TypeError):
+            logger.exception("Shared cache read failed for %s", key)
+            return default
+
+    # Like get() and set(), a cache file that is locked or broken is logged and treated as empty,
+    # so invalidating an entry or showing /api/status never fails because of the cache
+    def delete(self, key):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+        except sqlite3.Error:
+            logger.exception("Shared cache delete failed for %s", key)
+
+    def clear(self):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM cache_entry")
+        except sqlite3.Error:
+            logger.exception("Shared cache clear failed")
+
+    # Snapshot of the counters - entries and bytes are for the whole machine, the rest are for this process
+    def stats(self):
+        try:
+            count, total = self._connect().execute("SELECT COUNT(*), TOTAL(size) FROM cache_entry").fetchone()
+        except sqlite3.Error:
+            logger.exception("Shared cache stats failed")
+            count, total = 0, 0
+        return {
+            "entries": count,
+            "bytes": int(total),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    # Closes this thread's connection - call it before forking worker processes
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def __len__(self):
+        try:
+            return self._connect().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+        except sqlite3.Error:
+            logger.exception("Shared cache count failed")
+            return 0
@@ -0,0 +1,41 @@
+// Search as you type for the search bar - suggestions come from /api/suggest and are shown in a datalist
+const searchInput = document.getElementById("searchInput");
+const suggestions = document.getElementById("searchSuggestions");
+let suggestTimer = null;
+let lastQuery = "";
+// Wait until the user stops typing for a moment so every keystroke doesn't send a request
+searchInput.addEventListener("input", () => {
+  clearTimeout(suggestTimer);
+  suggestTimer = setTimeout(showSuggestions, 150);
+});
+
+async function showSuggestions() {
+  const query = searchInput.value.trim();
+  if (query === lastQuery) {
+    return;
+  }
+  lastQuery = query;
+  if (!query) {
+    suggestions.replaceChildren();
+    return;
+  }
+  try {
+    const response = await fetch("/api/suggest?q=" + encodeURIComponent(query));
+    const data = await response.json();
+    // The user may have kept typing while we waited - only show answers for what is in the box now
+    if (query !== lastQuery) {
+      return;
+    }
+    // textContent, not innerHTML, so a movie title can't inject HTML
+    suggestions.replaceChildren(
+      ...data.suggestions.map((movie) => {
+        const option = document.createElement("option");
+        option.value = movie.title;
+        option.textContent = movie.year ? movie.title + " (" + movie.year + ")" : movie.title;
+        return option;
+      })
+    );
+  } catch (error) {
+    // Suggestions are a nice to have - the search button still works without them
+  }
+}
@@ -0,0 +1,351 @@
+# Import statements
+# bisect finds the range of titles starting with what the user has typed in a sorted list
+import bisect
+# heapq picks the most popular matches without sorting all of them
+import heapq
+# logging is used when the catalog can't be read - suggestions must never break a page
+import logging
+import os
+# re and unicodedata turn titles and queries into plain lower case words without accents
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger(__name__)
+
+# The best matches for prefixes this short are worked out ahead of time,
+# because they match so many titles that ranking them on every keystroke would be too slow
+SHORT_PREFIX = 3
+# Longer prefixes that still match more keys than this have their best matches worked out the first time
+# they are searched for and kept up to date from then on, the same as the short ones
+SCAN_LIMIT = 2000
+# A title can be found by any of its first few words ("matr" finds "The Matrix")
+MAX_WORDS = 6
+# Sorts after every character, so (prefix + HIGHEST,) is just past the last key starting with prefix
+HIGHEST = "\U0010ffff"
+
+
+# Lower case words without accents, joined by single spaces - "Amélie!" -> "amelie"
+# Matches how the FTS index (unicode61 remove_diacritics) sees titles
+def normalize(text):
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+# The keys a title is found by - the title from each of its first MAX_WORDS words onwards
+def title_keys(normalized):
+    if not normalized:
+        return []
+    keys = [normalized]
+    start = normalized.find(" ")
+    while start != -1 and len(keys) < MAX_WORDS:
+        keys.append(normalized[start + 1:])
+        start = normalized.find(" ", start + 1)
+    return keys
+
+
+# Sorts keys, keeping values in the same order as their keys
+def _sort_together(keys, values):
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return [keys[i] for i in order], [values[i] for i in order]
+
+
+# The (start, end) positions of the keys in a sorted list starting with prefix
+def _prefix_range(keys, prefix):
+    start = bisect.bisect_left(keys, prefix)
+    return start, bisect.bisect_left(keys, prefix + HIGHEST, start)
+
+
+# Whether key is still one of the keys of a movie's (normalized) title
+# Keys of a movie's old title stay in the lists until the next merge, so searches check with this first
+def _is_key(normalized, key):
+    if normalized == key:
+        return True
+    if not normalized.endswith(key) or normalized[-len(key) - 1] != " ":
+        return False
+    # The key starts on a word boundary - it must be one of the first MAX_WORDS words too
+    return normalized.count(" ", 0, len(normalized) - len(key)) < MAX_WORDS
+
+
+# In-memory prefix index over the title of every movie in the local catalog, for search as you type
+# Keys are kept in a sorted list so all the titles starting with a prefix are found with two bisects
+# New titles go into a small second sorted list that is merged into the big one once it has grown
+# past merge_size, so adding a title never means re-sorting the whole catalog
+# The best movies for prefixes that match a lot of titles are kept in _top so they never have to be ranked
+# while someone is typing
+#
+# Searching never takes the lock - writers replace lists instead of changing them, so a search
+# always sees a complete list. One process-wide index is shared by every thread
+class PrefixIndex:
+    def __init__(self, top_size=10, merge_size=50000, refresh_interval=5.0):
+        # The most suggestions one search can return
+        self.top_size = top_size
+        self.merge_size = merge_size
+        # How often (seconds) refresh() looks for movies added to the catalog by other processes
+        self.refresh_interval = refresh_interval
+        # (sorted keys, movie id of each key) - _keys is the big list, _recent the titles added since the last merge
+        # Two plain lists instead of a list of pairs - half the memory and much faster to sort
+        self._keys = ([], [])
+        self._recent = ([], [])
+        # movie id -> (title, release year, popularity, vote count, normalized title)
+        self._movies = {}
+        # Prefix -> ids of the best top_size movies with a key starting with it, best first
+        # Every prefix up to SHORT_PREFIX long, and longer ones that match more than about SCAN_LIMIT keys
+        self._top = {}
+        # Keys left behind in _keys by movies whose title changed
+        self._stale = 0
+        self._lock = threading.Lock()
+        # Highest catalog change_seq loaded so far - None until the first load
+        self._loaded_until = None
+        self._last_refresh = 0.0
+        self.last_build_duration = None
+
+    # Popularity first, then how many people have voted
+    def _rank(self, movie_id):
+        movie = self._movies[movie_id]
+        return movie[2], movie[3]
+
+    # Loads every movie in the catalog the first time, then only the ones added or updated since
+    # Runs at most once every refresh_interval seconds, so it can be called on every request
+    # connect is a function returning a database connection - it is only called when a refresh is due,
+    # so keystrokes in between never open one
+    def refresh(self, connect):
+        now = time.monotonic()
+        if self._loaded_until is not None and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            # Another thread may have refreshed it while we were waiting for the lock
+            if self._loaded_until is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+            started = time.perf_counter()
+            try:
+                rows = connect().execute(
+                    "SELECT id, title, original_title, release_date, popularity, vote_count, change_seq "
+                    "FROM movie_catalog WHERE change_seq > ?",
+                    # Rows from before change_seq existed all have 0
+                    (-1 if self._loaded_until is None else self._loaded_until,),
+                ).fetchall()
+            except sqlite3.Error:
+                logger.exception("Could not load the movie catalog for suggestions")
+                return
+            movies = [
+                {"id": row[0], "title": row[1], "original_title": row[2], "release_date": row[3],
+                 "popularity": row[4], "vote_count": row[5]}
+                for row in rows
+            ]
+            if self._loaded_until is None:
+                self._build(movies)
+                self.last_build_duration = time.perf_counter() - started
+            else:
+                self._add(movies)
+            self._loaded_until = max([self._loaded_until or 0] + [row[6] for row in rows])
+
+    # Adds or updates movies seen in a TMDB response, so they can be suggested straight away
+    def add(self, movies):
+        with self._lock:
+            self._add(movies)
+
+    # Puts movies into _movies - returns the ones that are new or have a new title
+    # Missing values never replace ones we already have, the same as the catalog
+    # Must be called with the lock held
+    def _remember(self, movies):
+        retitled = []
+        for movie in movies:
+            movie_id = movie.get("id")
+            title = movie.get("title") or movie.get("original_title")
+            if movie_id is None or not title:
+                continue
+            old = self._movies.get(movie_id)
+            release_date = movie.get("release_date")
+            year = release_date[:4] if release_date else (old[1] if old else None)
+            popularity = movie.get("popularity")
+            vote_count = movie.get("vote_count")
+            if popularity is None:
+                popularity = old[2] if old else 0
+            if vote_count is None:
+                vote_count = old[3] if old else 0
+            if old is not None and not movie.get("title"):
+                # Like the catalog, an original title never replaces a title we already have
+                title = old[0]
+            normalized = old[4] if old is not None and old[0] == title else normalize(title)
+            self._movies[movie_id] = (title, year, popularity, vote_count, normalized)
+            if old is None or old[0] != title:
+                retitled.append(movie_id)
+        return retitled
+
+    # Builds the whole index from scratch
+    # Must be called with the lock held
+    def _build(self, movies):
+        self._remember(movies)
+        # Movies numbered from best to worst, so a smaller number is a better movie
+        order = sorted(self._movies, key=self._rank, reverse=True)
+        keys, positions = [], []
+        for position, movie_id in enumerate(order):
+            for key in title_keys(self._movies[movie_id][4]):
+                keys.append(key)
+                positions.append(position)
+        keys, positions = _sort_together(keys, positions)
+        top = {}
+        # A prefix's keys are next to each other in the sorted list, so its best movies are
+        # the smallest numbers in that part of the list
+        for prefix in self._busy_prefixes(keys):
+            start, end = _prefix_range(keys, prefix)
+            top[prefix] = [order[position] for position in heapq.nsmallest(self.top_size, set(positions[start:end]))]
+        self._top = top
+        self._keys = (keys, [order[position] for position in positions])
+        self._recent = ([], [])
+        self._stale = 0
+
+    # Every prefix up to SHORT_PREFIX long, and the longer ones that match more than about SCAN_LIMIT keys
+    @staticmethod
+    def _busy_prefixes(keys):
+        prefixes = set()
+        # Jumps from one prefix to the next with bisect instead of looking at every key
+        for length in range(1, SHORT_PREFIX + 1):
+            i = 0
+            while i < len(keys):
+                key = keys[i]
+                if len(key) < length:
+                    i = bisect.bisect_right(keys, key, i)
+                    continue
+                prefixes.add(key[:length])
+                i = bisect.bisect_left(keys, key[:length] + HIGHEST, i)
+        # A prefix matching more than SCAN_LIMIT keys is shared by two keys half that far apart somewhere
+        step = SCAN_LIMIT // 2
+        for i in range(0, len(keys) - step, step):
+            common = os.path.commonprefix([keys[i], keys[i + step]])
+            for length in range(SHORT_PREFIX + 1, len(common) + 1):
+                prefixes.add(common[:length])
+        return prefixes
+
+    # Adds new titles to the small list and updates the prefix lists in _top they belong in
+    # Must be called with the lock held
+    def _add(self, movies):
+        old_titles, old_ranks = {}, {}
+        for movie in movies:
+            movie_id = movie.get("id")
+            if movie_id in self._movies and movie_id not in old_titles:
+                old_titles[movie_id] = self._movies[movie_id][4]
+                old_ranks[movie_id] = self._rank(movie_id)
+        retitled = self._remember(movies)
+        if retitled:
+            # Keys for a movie's old title are left behind - searches skip them and the next merge drops them
+            self._stale += sum(len(title_keys(old_titles[movie_id])) for movie_id in retitled if movie_id in old_titles)
+            # Copies, so searches running at the same time keep seeing the old lists until they are replaced
+            keys, ids = list(self._recent[0]), list(self._recent[1])
+            for movie_id in retitled:
+                for key in title_keys(self._movies[movie_id][4]):
+                    i = bisect.bisect_right(keys, key)
+                    keys.insert(i, key)
+                    ids.insert(i, movie_id)
+            if len(keys) > self.merge_size:
+                self._merge((keys, ids))
+            else:
+                self._recent = (keys, ids)
+        # Prefix -> the changed movies that match it now or did before
+        # A changed popularity can move a movie up or down a list, and a new title moves it to other lists
+        changed = {}
+        for movie_id in set(old_titles) | set(retitled):
+            for prefix in self._top_prefixes(self._movies[movie_id][4]):
+                changed.setdefault(prefix, set()).add(movie_id)
+            if movie_id in retitled and movie_id in old_titles:
+                for prefix in self._top_prefixes(old_titles[movie_id]):
+                    if prefix in self._top:
+                        changed.setdefault(prefix, set()).add(movie_id)
+        for prefix, movie_ids in changed.items():
+            listed = self._top.get(prefix, [])
+            candidates = {other for other in listed if other not in movie_ids}
+            candidates.update(movie_id for movie_id in movie_ids if self._matches(movie_id, prefix))
+            ids = heapq.nlargest(self.top_size, candidates, key=self._rank)
+            if len(listed) >= self.top_size:
+                # Every movie left out of a full list ranked no higher than the worst one in it
+                # If a movie dropped out or fell below that, one of the left out movies may belong in the list now,
+                # and the only way to find it is to rank the prefix again
+                lowest = min(old_ranks[other] if other in old_ranks else self._rank(other) for other in listed)
+                if len(ids) < self.top_size or self._rank(ids[-1]) < lowest:
+                    ids = self._scan(prefix)[0]
+            self._top[prefix] = ids
+
+    # Merges the recent keys into the big list, dropping keys of old titles
+    # Must be called with the lock held
+    def _merge(self, recent):
+        keys = self._keys[0] + recent[0]
+        ids = self._keys[1] + recent[1]
+        if self._stale:
+            movies = self._movies
+            kept = [i for i, key in enumerate(keys) if _is_key(movies[ids[i]][4], key)]
+            keys, ids = [keys[i] for i in kept], [ids[i] for i in kept]
+            self._stale = 0
+        # Both lists are already sorted, which Python's sort spots, so this is a quick merge
+        # The big list first - a search between these two lines may see a key twice, but never miss one
+        self._keys = _sort_together(keys, ids)
+        self._recent = ([], [])
+
+    # Prefixes of a (normalized) title's keys that have (or should have) a list in _top
+    def _top_prefixes(self, normalized):
+        prefixes = set()
+        for key in title_keys(normalized):
+            for length in range(1, len(key) + 1):
+                if length <= SHORT_PREFIX or key[:length] in self._top:
+                    prefixes.add(key[:length])
+        return prefixes
+
+    # Whether one of a movie's title keys starts with prefix
+    def _matches(self, movie_id, prefix):
+        return any(key.startswith(prefix) for key in title_keys(self._movies[movie_id][4]))
+
+    # Ranks every movie with a key starting with prefix - returns (the best top_size ids, how many keys it looked at)
+    def _scan(self, prefix):
+        movies = self._movies
+        matches = set()
+        scanned = 0
+        for keys, key_ids in (self._keys, self._recent):
+            start, end = _prefix_range(keys, prefix)
+            scanned += end - start
+            for i in range(start, end):
+                # Skip keys left behind by a movie's old title
+                if _is_key(movies[key_ids[i]][4], keys[i]):
+                    matches.add(key_ids[i])
+        return heapq.nlargest(self.top_size, matches, key=self._rank), scanned
+
+    # The best movies with a title (or a word in the title) starting with what the user typed
+    # Returns dicts with the id, title and release year, best first
+    def suggest(self, query, limit=None):
+        limit = self.top_size if limit is None else min(limit, self.top_size)
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        ids = self._top.get(prefix)
+        if ids is None and len(prefix) <= SHORT_PREFIX:
+            # No title has a key starting with it
+            ids = []
+        if ids is None:
+            ids, scanned = self._scan(prefix)
+            if scanned > SCAN_LIMIT:
+                # Grown too popular to rank on every keystroke - remember the answer and keep it up to date
+                # Ranked again with the lock held, so a change made since the scan above can't be missed
+                with self._lock:
+                    if prefix not in self._top:
+                        self._top[prefix] = self._scan(prefix)[0]
+        results = []
+        for movie_id in ids[:limit]:
+            title, year, _, _, _ = self._movies[movie_id]
+            results.append({"id": movie_id, "title": title, "year": year})
+        return results
+
+    # Information about the index for monitoring
+    def status(self):
+        return {
+            "movies": len(self._movies),
+            "keys": len(self._keys[0]) + len(self._recent[0]),
+            "recent_keys": len(self._recent[0]),
+            "ranked_prefixes": len(self._top),
+            "last_build_duration": round(self.last_build_duration, 3) if self.last_build_duration is not None else None,
+        }
@@ -0,0 +1,73 @@
+"""
+Tests for the async serving mode (asgi.py)
+These check that the Flask app still renders pages on more than one thread when it is run from the event loop.
+Run them with: python -m pytest test_asgi.py
+"""
+
+import asyncio
+import threading
+import time
+
+from flask import Flask
+
+from asgi import _WsgiApp
+
+
+def make_slow_app(delay):
+    """A tiny Flask app whose only page takes `delay` seconds and says which thread rendered it."""
+    app = Flask(__name__)
+
+    @app.route("/")
+    def slow():
+        time.sleep(delay)
+        return str(threading.get_ident())
+
+    return app
+
+
+async def call(asgi_app, path="/"):
+    """Sends one GET request straight to an ASGI app and returns (status, body)."""
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [], "server": ("testserver", 80), "client": ("127.0.0.1", 1234),
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return status, body.decode()
+
+
+def test_pages_render_at_the_same_time():
+    """Four 0.3s pages should take about 0.3s, not 1.2s - they must not share one thread."""
+    asgi_app = _WsgiApp(make_slow_app(0.3), threads=4)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(asgi_app) for _ in range(4)))
+        return results, time.perf_counter() - started
+
+    results, took = asyncio.run(run())
+    assert [status for status, _ in results] == [200] * 4
+    assert len({body for _, body in results}) == 4
+    assert took < 0.9
+
+
+def test_render_threads_are_limited():
+    """With 2 render threads, 4 pages of 0.2s need two rounds."""
+    asgi_app = _WsgiApp(make_slow_app(0.2), threads=2)
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(call(asgi_app) for _ in range(4)))
+        return time.perf_counter() - started
+
+    assert asyncio.run(run()) >= 0.4
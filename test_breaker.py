@@ -0,0 +1,140 @@
+"""
+Tests for the circuit breaker around TMDB (breaker.py)
+The breaker's clock is faked, so a test can jump past the open period instead of waiting for it.
+The last test goes through app.tmdb_fetch to check an expired copy is served while the circuit is open.
+Run them with: python -m pytest test_breaker.py
+"""
+
+import time
+
+import pytest
+import requests
+
+import breaker
+from breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 500.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(breaker.time, "monotonic", fake)
+    return fake
+
+
+def make_breaker():
+    return CircuitBreaker("tmdb", window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=2.0,
+                          slow_rate=0.5, open_seconds=30, half_open_calls=2)
+
+
+def fail(circuit, times):
+    for _ in range(times):
+        circuit.allow()
+        circuit.record(False, 0.1)
+
+
+def test_stays_closed_until_enough_calls(clock):
+    circuit = make_breaker()
+    fail(circuit, 3)
+    # 3 failures out of 3, but fewer than min_calls, so it's too early to judge
+    assert circuit.state == CLOSED
+
+
+def test_full_cycle_closed_open_half_open_closed(clock):
+    circuit = make_breaker()
+    for _ in range(2):
+        circuit.allow()
+        circuit.record(True, 0.1)
+    fail(circuit, 2)
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 1
+
+    # While open, calls fail straight away without reaching TMDB
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+    assert circuit.rejected == 1
+
+    # After open_seconds a limited number of probe calls go through
+    clock.now += 30
+    circuit.allow()
+    assert circuit.state == HALF_OPEN
+    circuit.allow()
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+    # Both probes work, so the circuit closes with a clean history
+    circuit.record(True, 0.1)
+    circuit.record(True, 0.1)
+    assert circuit.state == CLOSED
+    assert circuit.status()["recent_calls"] == 0
+
+
+def test_failed_probe_opens_again(clock):
+    circuit = make_breaker()
+    fail(circuit, 4)
+    clock.now += 31
+    circuit.allow()
+    circuit.record(False, 0.1)
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 2
+    # The new open period starts from the failed probe
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+
+def test_slow_calls_open_the_circuit(clock):
+    circuit = make_breaker()
+    for _ in range(4):
+        circuit.allow()
+        circuit.record(True, 5.0)
+    assert circuit.state == OPEN
+    assert circuit.status()["slow_rate"] == 1.0
+
+
+def test_calls_started_before_opening_are_ignored(clock):
+    circuit = make_breaker()
+    fail(circuit, 4)
+    circuit.record(True, 0.1)
+    assert circuit.state == OPEN
+
+
+def test_open_error_is_a_requests_error():
+    # Routes already catch requests errors to fall back on cached data, so they cope with an open circuit too
+    assert issubclass(CircuitOpenError, requests.ConnectionError)
+
+
+def test_stale_copy_is_served_while_open(monkeypatch):
+    app_module = pytest.importorskip("app")
+    from cache import TTLCache, make_key
+    from tmdb import TMDBClient
+
+    circuit = CircuitBreaker("tmdb-test", min_calls=1, open_seconds=60)
+    circuit.allow()
+    circuit.record(False, 0.1)
+    assert circuit.state == OPEN
+
+    # Nothing may reach the network - an open circuit has to stop the call first
+    def no_network(*args, **kwargs):
+        raise AssertionError("TMDB was called while the circuit was open")
+
+    client = TMDBClient("test-key", base_url="https://tmdb.invalid/3", breaker=circuit)
+    monkeypatch.setattr(client.session, "get", no_network)
+    cache = TTLCache()
+    monkeypatch.setattr(app_module, "tmdb_client", client)
+    monkeypatch.setattr(app_module, "tmdb_cache", cache)
+
+    cache.set(make_key("/search/movie", {"query": "heat"}), {"results": [{"id": 949}]}, ttl=0.01)
+    time.sleep(0.02)
+    assert app_module.tmdb_fetch("search", "/search/movie", {"query": "heat"}) == {"results": [{"id": 949}]}
+
+    # With no copy at all the error reaches the route, which shows its fallback
+    with pytest.raises(CircuitOpenError):
+        app_module.tmdb_fetch("search", "/search/movie", {"query": "ronin"})
@@ -0,0 +1,236 @@
+"""
+Tests for the in-memory TMDB response cache and request coalescing in cache.py
+TTLCache's clock is faked so entries can be expired without sleeping.
+SingleFlight is what stops a burst of visitors to an uncached page all calling TMDB for the same thing.
+Run them with: python -m pytest test_cache.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import AsyncSingleFlight, SingleFlight, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    ttl_cache = TTLCache(default_ttl=60)
+    ttl_cache.set("trending", [1, 2, 3])
+    ttl_cache.set("movie/1", {"id": 1}, ttl=3600)
+    clock[0] += 59
+    assert ttl_cache.get("trending") == [1, 2, 3]
+    clock[0] += 1
+    assert ttl_cache.get("trending") is None
+    assert ttl_cache.info("trending") is None
+    assert ttl_cache.get("movie/1") == {"id": 1}
+    # Still there for when TMDB is down
+    assert ttl_cache.get_stale("trending") == [1, 2, 3]
+    assert ttl_cache.stats()["expirations"] == 1
+
+
+def test_get_makes_an_entry_most_recently_used(clock):
+    ttl_cache = TTLCache(max_entries=3)
+    for key in ("a", "b", "c"):
+        ttl_cache.set(key, key)
+    ttl_cache.get("a")
+    ttl_cache.set("d", "d")
+    # "b" was the least recently used once "a" had been read - get_stale() checks without changing the order
+    assert [ttl_cache.get_stale(key) for key in ("a", "b", "c", "d")] == ["a", None, "c", "d"]
+    # info() and get_stale() only look, so they don't save an entry from eviction
+    ttl_cache.info("c")
+    ttl_cache.set("e", "e")
+    assert [ttl_cache.get_stale(key) for key in ("a", "c", "d", "e")] == ["a", None, "d", "e"]
+
+
+def test_byte_limit_and_oversize_values(clock):
+    ttl_cache = TTLCache(max_bytes=1000)
+    for i in range(4):
+        ttl_cache.set(f"page-{i}", i, size=300)
+    assert ttl_cache.stats()["bytes"] == 900
+    assert ttl_cache.get("page-0") is None
+    assert len(ttl_cache) == 3
+    # Replacing a value doesn't count its old size twice
+    ttl_cache.set("page-3", "again", size=300)
+    assert ttl_cache.stats()["bytes"] == 900
+    # A value bigger than the whole cache is not stored, and nothing is evicted for it
+    ttl_cache.set("huge", "x", size=1001)
+    assert ttl_cache.get("huge") is None
+    assert len(ttl_cache) == 3
+
+
+def test_counters(clock):
+    ttl_cache = TTLCache(max_entries=1, default_ttl=10)
+    ttl_cache.set("a", 1)
+    ttl_cache.get("a")
+    ttl_cache.get("missing")
+    ttl_cache.set("b", 2)
+    clock[0] += 10
+    ttl_cache.get("b")
+    assert ttl_cache.stats() == {"entries": 1, "bytes": ttl_cache.stats()["bytes"], "hits": 1, "misses": 2,
+                                 "evictions": 1, "expirations": 1}
+
+
+def test_versions_change_when_a_value_is_replaced(clock):
+    ttl_cache = TTLCache()
+    ttl_cache.set("trending", 1)
+    first = ttl_cache.version("trending")
+    ttl_cache.set("trending", 2)
+    assert ttl_cache.version("trending") != first
+    ttl_cache.set("trending", 2, version="abc123")
+    assert ttl_cache.version("trending") == "abc123"
+    ttl_cache.delete("trending")
+    assert ttl_cache.version("trending") is None
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow_fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"id": 1}
+
+    results = []
+
+    def caller():
+        results.append(flight.do("movie/1", slow_fetch))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    # Only start the others once the first call is running, so they are sure to overlap with it
+    started.wait()
+    followers = [threading.Thread(target=caller) for _ in range(9)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"id": 1}] * 10
+    assert flight.shared == 9
+
+
+def test_error_is_shared_and_not_remembered():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_fetch():
+        started.set()
+        release.wait()
+        raise ValueError("TMDB is down")
+
+    errors = []
+
+    def caller():
+        try:
+            flight.do("movie/2", failing_fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller)]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=caller))
+    threads[1].start()
+    # Give the second caller time to start waiting on the first one's call
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2
+    # The failed call is forgotten, so the next caller tries again
+    assert flight.do("movie/2", lambda: "back") == "back"
+
+
+def test_interrupted_leader_does_not_hand_out_none():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupted_fetch():
+        started.set()
+        release.wait()
+        raise Interrupted()
+
+    outcomes = []
+
+    def leader():
+        try:
+            flight.do("movie/3", interrupted_fetch)
+        except Interrupted:
+            outcomes.append("leader interrupted")
+
+    def follower():
+        try:
+            outcomes.append(flight.do("movie/3", lambda: "never called"))
+        except Interrupted:
+            outcomes.append("follower interrupted")
+
+    threads = [threading.Thread(target=leader)]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=follower))
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ["follower interrupted", "leader interrupted"]
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.shared == 0
+
+
+def test_async_callers_share_one_task():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "trending"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("trending", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["trending"] * 5
+    assert len(calls) == 1
+
+
+def test_async_caller_giving_up_does_not_cancel_the_fetch():
+    flight = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.1)
+        return "done"
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(flight.do("slow", fetch), timeout=0.01)
+        # A second caller joins the same fetch, which kept going
+        return await flight.do("slow", fetch)
+
+    assert asyncio.run(run()) == "done"
+    assert flight.shared == 1
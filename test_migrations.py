@@ -0,0 +1,47 @@
+"""
+Tests for the schema migrations runner (migrations.py)
+Uses an in-memory database and made up migrations, so it never touches the real schema.
+Run them with: python -m pytest test_migrations.py
+"""
+
+import sqlite3
+
+import pytest
+
+from migrations import current_version, migrate
+
+GOOD = [
+    (1, "create_movie", ["CREATE TABLE movie (id INTEGER PRIMARY KEY, title TEXT)"]),
+    (2, "movie_title_index", ["CREATE INDEX ix_movie_title ON movie (title)"]),
+]
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+def test_applies_pending_migrations_once():
+    conn = sqlite3.connect(":memory:")
+    assert migrate(conn, GOOD) == [(1, "create_movie"), (2, "movie_title_index")]
+    assert migrate(conn, GOOD) == []
+    assert current_version(conn) == 2
+    assert {"movie", "ix_movie_title"} <= tables(conn)
+
+
+def test_failed_migration_leaves_no_partial_schema():
+    conn = sqlite3.connect(":memory:")
+    broken = GOOD + [(3, "review", [
+        "CREATE TABLE review (id INTEGER PRIMARY KEY, movie_id INTEGER)",
+        "ALTER TABLE movie ADD COLUMN year INTEGER",
+        "CREATE INDEX ix_review_movie ON no_such_table (movie_id)",
+    ])]
+    with pytest.raises(sqlite3.OperationalError):
+        migrate(conn, broken)
+    # Migrations 1 and 2 stay applied, and nothing of migration 3 is left behind
+    assert current_version(conn) == 2
+    assert "review" not in tables(conn)
+    assert "year" not in [row[1] for row in conn.execute("PRAGMA table_info(movie)")]
+    # Once it is fixed it runs from the start
+    broken[2][2][2] = "CREATE INDEX ix_review_movie ON review (movie_id)"
+    assert migrate(conn, broken) == [(3, "review")]
+    assert conn.isolation_level == ""
@@ -0,0 +1,135 @@
+"""
+Tests for the TMDB rate limiter (ratelimit.py)
+The rates are kept high and the waits short so the whole file runs in a couple of seconds.
+Run them with: python -m pytest test_ratelimit.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ratelimit import PriorityRateLimiter, RateLimitedError
+
+
+def make_limiter(rate, burst, wait=1.0):
+    return PriorityRateLimiter(rate, burst, {"background": wait, "page": wait, "search": wait, "prefetch": 0.0})
+
+
+def empty(limiter):
+    # Uses up the burst so every call from now on has to wait
+    for _ in range(limiter.burst):
+        limiter.acquire("page")
+
+
+def wait_for_waiters(limiter, count):
+    deadline = time.monotonic() + 1
+    while sum(limiter.status()["waiting"].values()) < count:
+        assert time.monotonic() < deadline, "callers never started waiting"
+        time.sleep(0.005)
+
+
+def test_burst_is_served_straight_away():
+    limiter = make_limiter(rate=1, burst=5)
+    started = time.perf_counter()
+    for _ in range(5):
+        limiter.acquire("search")
+    assert time.perf_counter() - started < 0.1
+    assert limiter.status()["granted"]["search"] == 5
+
+
+def test_more_important_calls_get_the_next_token():
+    limiter = make_limiter(rate=5, burst=1)
+    empty(limiter)
+    order = []
+
+    def call(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+
+    # Least important first, so arriving first is not what puts the others ahead
+    threads = []
+    for count, priority in enumerate(("search", "page", "background"), start=1):
+        thread = threading.Thread(target=call, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        wait_for_waiters(limiter, count)
+    for thread in threads:
+        thread.join()
+
+    assert order == ["background", "page", "search"]
+
+
+def test_hopeless_wait_fails_straight_away():
+    limiter = make_limiter(rate=1, burst=1, wait=0.5)
+    empty(limiter)
+    started = time.perf_counter()
+    # The next token is a second away, longer than the 0.5s a page call may wait
+    with pytest.raises(RateLimitedError):
+        limiter.acquire("page")
+    assert time.perf_counter() - started < 0.05
+    assert limiter.status()["rejected"]["page"] == 1
+
+
+def test_prefetch_never_waits():
+    limiter = make_limiter(rate=100, burst=1)
+    limiter.acquire("prefetch")
+    with pytest.raises(RateLimitedError):
+        limiter.acquire("prefetch")
+
+
+def test_call_gives_up_when_pushed_back_past_its_wait():
+    limiter = make_limiter(rate=2, burst=1, wait=0.7)
+    empty(limiter)
+    errors = []
+
+    def search():
+        try:
+            limiter.acquire("search")
+        except RateLimitedError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=search)
+    thread.start()
+    wait_for_waiters(limiter, 1)
+    # The search would get the token due in 0.5s, but the trending refresh jumps ahead of it
+    # and the token after that is too late for the search
+    limiter.acquire("background")
+    thread.join()
+
+    assert len(errors) == 1
+    assert limiter.status()["waiting"]["search"] == 0
+
+
+def test_async_callers_wait_without_blocking_the_loop():
+    limiter = make_limiter(rate=20, burst=1)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(ticker(), *(limiter.acquire_async("page") for _ in range(4)))
+
+    asyncio.run(run())
+    # 4 calls with 1 token to start with need about 0.15s, and the loop kept running the whole time
+    assert limiter.status()["granted"]["page"] == 4
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.05
+
+
+def test_reserve_keeps_the_last_tokens_for_other_calls():
+    limiter = PriorityRateLimiter(1, 5, {"page": 1.0, "prefetch": 0.0}, reserve={"prefetch": 3})
+    assert limiter.has_spare("prefetch")
+    # 5 tokens and 3 of them reserved - only 2 prefetches get through
+    limiter.acquire("prefetch")
+    limiter.acquire("prefetch")
+    assert not limiter.has_spare("prefetch")
+    with pytest.raises(RateLimitedError):
+        limiter.acquire("prefetch")
+    # The reserve is still there for pages
+    for _ in range(3):
+        limiter.acquire("page")
+    assert limiter.status()["granted"] == {"background": 0, "page": 3, "search": 0, "prefetch": 2}
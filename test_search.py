@@ -0,0 +1,188 @@
+"""
+Tests for paging through search results and prefetching the next page (the /search route in app.py)
+TMDB is replaced by a fake client that makes up 3 pages of results for any query, and the app uses
+a throwaway database, so nothing here needs a network or an API key.
+Run them with: python -m pytest test_search.py
+"""
+
+import json
+import threading
+import uuid
+
+import pytest
+import sqlalchemy
+
+app_module = pytest.importorskip("app")
+
+import database
+import migrations
+from cache import TTLCache
+from models import db
+from ratelimit import PriorityRateLimiter
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.content = json.dumps(data).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeTMDB:
+    """Answers every search with page N of 3 and remembers what was asked for."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, endpoint, params=None, priority="page"):
+        page = params.get("page", 1)
+        with self.lock:
+            self.calls.append((params["query"], page, priority))
+        return FakeResponse({"page": page, "total_pages": 3, "results": [
+            {"id": hash((params["query"], page, i)) % 10**9, "title": f"{params['query']} page {page} result {i}",
+             "overview": "", "popularity": 1.0, "vote_count": 1}
+            for i in range(3)
+        ]})
+
+    def pages(self, query):
+        with self.lock:
+            return [(page, priority) for q, page, priority in self.calls if q == query]
+
+
+@pytest.fixture(scope="module")
+def database_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("search") / "cinefiles.db")
+    db.metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+    return path
+
+
+@pytest.fixture
+def tmdb(monkeypatch, database_path):
+    flask_app = app_module.app
+    monkeypatch.setitem(flask_app.config, "SQLITE_PATH", database_path)
+    migrations.migrate_app(flask_app)
+    database.close_thread_db()
+    fake = FakeTMDB()
+    monkeypatch.setattr(app_module.tmdb_client, "get", fake.get)
+    monkeypatch.setattr(app_module, "tmdb_cache", TTLCache())
+    monkeypatch.setattr(app_module, "tmdb_limiter", PriorityRateLimiter(100, 100, {}, reserve={"prefetch": 10}))
+    yield fake
+    wait_for_prefetches()
+    database.close_thread_db()
+
+
+@pytest.fixture
+def client(tmdb):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def blocked_pool():
+    """Keeps every prefetch thread busy until the test is done, so new prefetches wait in the queue."""
+    release = threading.Event()
+    blockers = [app_module.prefetch_pool.submit(release.wait)
+                for _ in range(app_module.app.config["SEARCH_PREFETCH_WORKERS"])]
+    yield release
+    release.set()
+    for blocker in blockers:
+        blocker.result()
+
+
+def wait_for_prefetches():
+    with app_module.search_prefetch_lock:
+        futures = list(app_module.search_prefetches.values())
+    for future in futures:
+        if not future.cancelled():
+            future.result(timeout=5)
+
+
+def unique_query():
+    # The local search index is shared between tests - a new word each time keeps its results out of the way
+    return "q" + uuid.uuid4().hex[:10]
+
+
+def search(client, query, page=1, referrer=None):
+    headers = {"Referer": referrer} if referrer else {}
+    return client.get("/search", query_string={"query": query, "page": page, "source": "tmdb"}, headers=headers)
+
+
+def test_pages_of_tmdb_results(client, tmdb):
+    query = unique_query()
+    response = search(client, query, page=2)
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert f"{query} page 2 result 0" in html
+    assert "Page 2 of 3" in html
+    assert "Previous" in html and "Next" in html
+    wait_for_prefetches()
+    # The last page has no next page to link to or prefetch
+    html = search(client, query, page=3).get_data(as_text=True)
+    assert "Page 3 of 3" in html and "Next" not in html
+    wait_for_prefetches()
+    assert sorted(tmdb.pages(query)) == [(2, "search"), (3, "prefetch")]
+
+
+def test_anonymous_search_sets_no_cookie(client):
+    response = search(client, unique_query())
+    assert "Set-Cookie" not in response.headers
+    assert "Cookie" not in response.headers.get("Vary", "")
+
+
+def test_next_page_is_prefetched_and_served_from_the_cache(client, tmdb):
+    query = unique_query()
+    search(client, query)
+    wait_for_prefetches()
+    assert tmdb.pages(query) == [(1, "search"), (2, "prefetch")]
+    # Clicking "next" doesn't need TMDB any more
+    html = search(client, query, page=2).get_data(as_text=True)
+    assert f"{query} page 2 result 0" in html
+    wait_for_prefetches()
+    assert tmdb.pages(query) == [(1, "search"), (2, "prefetch"), (3, "prefetch")]
+
+
+def test_new_query_cancels_the_last_ones_prefetch(client, tmdb, blocked_pool):
+    first, second = unique_query(), unique_query()
+    search(client, first)
+    assert len(app_module.search_prefetches) == 1
+    # The browser searches again from the first query's results page
+    search(client, second, referrer=f"http://localhost/search?query={first}&source=tmdb")
+    blocked_pool.set()
+    wait_for_prefetches()
+    assert tmdb.pages(first) == [(1, "search")]
+    assert tmdb.pages(second) == [(1, "search"), (2, "prefetch")]
+
+
+def test_other_browsers_searches_do_not_cancel_a_prefetch(client, tmdb, blocked_pool):
+    first, second = unique_query(), unique_query()
+    search(client, first)
+    # Another browser behind the same address searching for something else
+    search(client, second, referrer="http://localhost/")
+    blocked_pool.set()
+    wait_for_prefetches()
+    assert tmdb.pages(first) == [(1, "search"), (2, "prefetch")]
+    assert tmdb.pages(second) == [(1, "search"), (2, "prefetch")]
+
+
+def test_prefetches_are_capped_for_the_whole_process(client, tmdb, blocked_pool):
+    queries = [unique_query() for _ in range(app_module.app.config["SEARCH_PREFETCH_MAX"] + 2)]
+    for query in queries:
+        search(client, query)
+    # Past the cap a prefetch is skipped rather than queued
+    assert len(app_module.search_prefetches) == app_module.app.config["SEARCH_PREFETCH_MAX"]
+    # The same page is only prefetched once however many people read the page before it
+    search(client, queries[0])
+    assert len(app_module.search_prefetches) == app_module.app.config["SEARCH_PREFETCH_MAX"]
+    blocked_pool.set()
+    wait_for_prefetches()
+    assert sum((2, "prefetch") in tmdb.pages(query) for query in queries) == app_module.app.config["SEARCH_PREFETCH_MAX"]
+    assert app_module.search_prefetches == {}
+
+
+def test_no_prefetch_without_spare_quota(client, tmdb, monkeypatch):
+    monkeypatch.setattr(app_module, "tmdb_limiter", PriorityRateLimiter(0.001, 5, {}, reserve={"prefetch": 10}))
+    query = unique_query()
+    search(client, query)
+    wait_for_prefetches()
+    assert tmdb.pages(query) == [(1, "search")]
@@ -0,0 +1,154 @@
+"""
+Tests for the SQLite cache shared by worker processes (shared_cache.py)
+Each test gets a fresh cache file in pytest's tmp_path. The clock is faked where TTLs matter.
+Run them with: python -m pytest test_shared_cache.py
+"""
+
+import os
+
+import pytest
+
+import shared_cache
+from shared_cache import SQLiteCache
+
+
+class FakeClock:
+    """Stands in for time.time() so entries can be expired without sleeping."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(shared_cache.time, "time", fake)
+    return fake
+
+
+def test_values_round_trip(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    value = {"results": [{"id": 1, "title": "Heat", "vote_average": 7.9, "adult": False, "video": None}]}
+    cache.set("trending", value)
+    assert cache.get("trending") == value
+    assert cache.get("missing", "default") == "default"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), default_ttl=60)
+    cache.set("search", ["a"])
+    cache.set("movie", ["b"], ttl=600)
+    clock.now += 61
+    assert cache.get("search") is None
+    assert cache.info("search") is None
+    assert cache.get("movie") == ["b"]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_expired_entries_are_kept_for_stale_reads(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), default_ttl=60)
+    cache.set("trending", {"page": 1})
+    clock.now += 3600
+    assert cache.get("trending") is None
+    # TMDB is down - the expired copy is still there as a last resort
+    assert cache.get_stale("trending") == {"page": 1}
+    assert cache.get_stale("never-stored", "none") == "none"
+
+
+def test_very_old_entries_are_dropped_for_good(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(shared_cache, "EVICT_INTERVAL", 0)
+    cache = SQLiteCache(str(tmp_path / "cache.db"), default_ttl=60)
+    cache.set("old", 1)
+    clock.now += 60 + shared_cache.STALE_TTL + 1
+    # Eviction runs on writes
+    cache.set("new", 2)
+    assert cache.get_stale("old") is None
+    assert cache.get("new") == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(shared_cache, "EVICT_INTERVAL", 0)
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+        clock.now += 1
+    # Reading "a" after TOUCH_INTERVAL makes it the most recently used
+    clock.now += shared_cache.TOUCH_INTERVAL
+    assert cache.get("a") == "a"
+    clock.now += 1
+    cache.set("d", "d")
+    assert len(cache) == 3
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ("a", "c", "d")] == ["a", "c", "d"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_limit_is_enforced(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "EVICT_INTERVAL", 0)
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_bytes=2500)
+    for i in range(5):
+        cache.set(f"poster-{i}", "x" * 1000)
+    assert cache.stats()["bytes"] <= 2500
+    # A value bigger than the whole cache is not stored at all
+    cache.set("huge", "x" * 5000)
+    assert cache.get("huge") is None
+
+
+def test_versions_match_between_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first, second = SQLiteCache(path), SQLiteCache(path)
+    first.set("trending", {"page": 1})
+    # Another worker sees the same value and the same version, so ETags agree
+    assert second.get("trending") == {"page": 1}
+    assert first.version("trending") == second.version("trending") is not None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_opens_its_own_connection(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    cache.set("before-fork", 1)
+    parent_conn = cache._connect()
+    pid = os.fork()
+    if pid == 0:
+        # Child - the connection inherited from the parent must not be used
+        status = 1
+        try:
+            if cache._connect() is not parent_conn and cache.get("before-fork") == 1:
+                cache.set("from-child", 2)
+                status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    # The parent keeps using its own connection and sees what the child wrote
+    assert cache._connect() is parent_conn
+    assert cache.get("from-child") == 2
+
+
+def test_close_opens_a_new_connection_on_next_use(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    cache.set("a", 1)
+    old = cache._connect()
+    cache.close()
+    assert cache._connect() is not old
+    assert cache.get("a") == 1
+
+
+def test_broken_cache_file_never_raises(tmp_path, caplog):
+    path = tmp_path / "cache.db"
+    cache = SQLiteCache(str(path))
+    cache.set("trending", {"page": 1})
+    cache.close()
+    # Something else overwrote the file - every call should log and carry on as if the cache were empty
+    path.write_bytes(b"this is not a database" * 100)
+    assert cache.get("trending") is None
+    cache.set("trending", {"page": 2})
+    cache.delete("trending")
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+    assert "Shared cache" in caplog.text
@@ -0,0 +1,195 @@
+"""
+Tests for search as you type (suggest.py)
+Every answer from the index is checked against ranking all the titles the slow way,
+after the index has been built and after movies are added, change popularity and are renamed.
+Run them with: python -m pytest test_suggest.py
+"""
+
+import random
+import sqlite3
+
+import pytest
+
+import search_index
+import suggest
+from suggest import PrefixIndex, normalize, title_keys
+
+WORDS = ["the", "matrix", "man", "mad", "max", "star", "stars", "wars", "trek", "return",
+         "of", "king", "kong", "amélie", "thief", "theory", "mars", "attack", "night", "knight"]
+
+
+@pytest.fixture(autouse=True)
+def small_scan_limit(monkeypatch):
+    # A few hundred titles are enough to give long prefixes their own remembered lists
+    monkeypatch.setattr(suggest, "SCAN_LIMIT", 20)
+
+
+def random_title(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+
+def random_movie(rng, movie_id, title=None):
+    return {"id": movie_id, "title": title or random_title(rng), "release_date": "1999-03-31",
+            "popularity": rng.random() * 100, "vote_count": rng.randint(0, 5000)}
+
+
+def brute_force(movies, query, limit=10):
+    prefix = normalize(query)
+    matches = [movie for movie in movies.values()
+               if any(key.startswith(prefix) for key in title_keys(normalize(movie["title"])))]
+    matches.sort(key=lambda movie: (movie["popularity"], movie["vote_count"]), reverse=True)
+    return [movie["id"] for movie in matches[:limit]]
+
+
+def queries():
+    for word in WORDS:
+        for length in range(1, len(word) + 1):
+            yield word[:length]
+    yield from ["the m", "star w", "return of the", "mad max", "Amelie", "THE  MATRIX!", "zzz"]
+
+
+def check(index, movies):
+    for query in queries():
+        assert [s["id"] for s in index.suggest(query)] == brute_force(movies, query), query
+
+
+def build(rng, count, **kwargs):
+    movies = {movie_id: random_movie(rng, movie_id) for movie_id in range(count)}
+    index = PrefixIndex(**kwargs)
+    index._build(list(movies.values()))
+    # Searching once makes the index remember the lists for the busy long prefixes
+    check(index, movies)
+    return index, movies
+
+
+def test_matches_brute_force_after_build():
+    index, movies = build(random.Random(1), 500)
+    assert index.status()["ranked_prefixes"] > 30
+
+
+def test_new_movies():
+    rng = random.Random(2)
+    index, movies = build(rng, 300)
+    for movie_id in range(300, 400):
+        movies[movie_id] = random_movie(rng, movie_id)
+        index.add([movies[movie_id]])
+    check(index, movies)
+
+
+def test_popularity_drops_pull_in_the_next_best():
+    rng = random.Random(3)
+    index, movies = build(rng, 400)
+    # Every movie that leads a list drops to the bottom
+    for query in ("t", "ma", "star", "the"):
+        for suggestion in index.suggest(query)[:3]:
+            movie = movies[suggestion["id"]]
+            movie["popularity"] = rng.random() / 1000
+            index.add([{"id": movie["id"], "title": movie["title"], "popularity": movie["popularity"]}])
+    check(index, movies)
+
+
+def test_popularity_rises():
+    rng = random.Random(4)
+    index, movies = build(rng, 400)
+    for movie in rng.sample(list(movies.values()), 50):
+        movie["popularity"] = 100 + rng.random() * 100
+        index.add([movie])
+    check(index, movies)
+
+
+def test_renamed_movies_leave_their_old_lists():
+    rng = random.Random(5)
+    index, movies = build(rng, 400)
+    leaders = {suggestion["id"] for query in ("m", "ma", "mat", "matrix", "star") for suggestion in index.suggest(query)}
+    for movie_id in leaders:
+        movies[movie_id]["title"] = random_title(rng) + " zodiac"
+        index.add([movies[movie_id]])
+    check(index, movies)
+    assert all(suggestion["id"] in leaders for suggestion in index.suggest("zodiac"))
+
+
+def test_random_changes_in_batches_and_merges():
+    rng = random.Random(6)
+    # A tiny merge_size so the recent list is merged (and old title keys dropped) many times
+    index, movies = build(rng, 300, merge_size=50)
+    next_id = 300
+    for _ in range(40):
+        batch = []
+        for _ in range(rng.randint(1, 8)):
+            choice = rng.random()
+            if choice < 0.3:
+                movie = random_movie(rng, next_id)
+                movies[next_id] = movie
+                next_id += 1
+            else:
+                movie = movies[rng.choice(list(movies))]
+                if choice < 0.7:
+                    movie["popularity"] = rng.random() * 100
+                else:
+                    movie["title"] = random_title(rng)
+            batch.append(dict(movie))
+        index.add(batch)
+        check(index, movies)
+
+
+def test_old_title_keys_are_not_matched():
+    index = PrefixIndex()
+    index._build([{"id": 1, "title": "Rix", "popularity": 1, "vote_count": 1}])
+    index.add([{"id": 1, "title": "Matrix"}])
+    # "rix" is the end of "matrix" but not a word in it
+    assert index.suggest("ri") == []
+    assert [s["title"] for s in index.suggest("mat")] == ["Matrix"]
+
+
+def catalog():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE movie_catalog (id INTEGER PRIMARY KEY, title TEXT NOT NULL, original_title TEXT, "
+                 "overview TEXT, release_date TEXT, poster_path TEXT, popularity REAL, vote_average REAL, "
+                 "vote_count INTEGER, updated_at REAL NOT NULL, change_seq INTEGER NOT NULL DEFAULT 0)")
+    return conn
+
+
+def write(conn, movie_id, title, popularity):
+    with conn:
+        search_index.upsert_movies(conn, [{"id": movie_id, "title": title, "popularity": popularity, "vote_count": 1}])
+
+
+def test_refresh_only_connects_when_due(monkeypatch):
+    conn = catalog()
+    write(conn, 1, "Heat", 30)
+    clock = [100.0]
+    monkeypatch.setattr(suggest.time, "monotonic", lambda: clock[0])
+    connects = []
+
+    def connect():
+        connects.append(1)
+        return conn
+
+    index = PrefixIndex(refresh_interval=5.0)
+    index.refresh(connect)
+    write(conn, 2, "Heathers", 10)
+    # Keystrokes in between don't touch the database at all
+    for _ in range(10):
+        index.refresh(connect)
+    assert len(connects) == 1
+    assert [s["title"] for s in index.suggest("hea")] == ["Heat"]
+    clock[0] += 5
+    index.refresh(connect)
+    assert len(connects) == 2
+    assert [s["title"] for s in index.suggest("hea")] == ["Heat", "Heathers"]
+
+
+def test_refresh_finds_rows_committed_late_with_an_older_timestamp(monkeypatch):
+    conn = catalog()
+    # Rows from before change_seq existed
+    conn.execute("INSERT INTO movie_catalog (id, title, popularity, vote_count, updated_at) VALUES (1, 'Heat', 30, 1, 500)")
+    index = PrefixIndex(refresh_interval=0)
+    index.refresh(lambda: conn)
+    write(conn, 2, "Heathers", 20)
+    index.refresh(lambda: conn)
+    # A writer that read the clock before the last refresh commits after it
+    monkeypatch.setattr(search_index.time, "time", lambda: 1.0)
+    write(conn, 3, "Heavy", 10)
+    write(conn, 1, "Heat", 5)
+    index.refresh(lambda: conn)
+    assert [s["title"] for s in index.suggest("hea")] == ["Heathers", "Heavy", "Heat"]
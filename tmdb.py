@@ -0,0 +1,157 @@
+# Import statements
+# requests is used for talking to the TMDB API over HTTP
+import requests
+# HTTPAdapter and Retry let us pool connections and retry failed calls
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import time
+# asyncio and httpx are only used by the async client for the ASGI serving mode
+import asyncio
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Base URL for every call to the TMDB API
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+# Base URL for poster images
+TMDB_IMAGE_URL = "https://image.tmdb.org/t/p"
+# Answers from TMDB that are worth trying again after a short wait
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Did TMDB answer properly? A 404 is a proper answer, being busy or broken is not
+def is_healthy_status(status_code):
+    return status_code < 500 and status_code not in RETRY_STATUSES
+
+
+# Client for the TMDB API
+# Holds one pooled session so connections are kept alive and reused between calls
+# instead of doing a new TCP + TLS handshake for every request
+# breaker and image_breaker are optional circuit breakers (breaker.CircuitBreaker) for API and image calls
+# limiter is an optional rate limiter (ratelimit.PriorityRateLimiter) that keeps API calls under TMDB's quota
+class TMDBClient:
+    def __init__(self, api_key, base_url=TMDB_BASE_URL, pool_size=10,
+                 connect_timeout=3.05, read_timeout=10, max_retries=2, backoff_factor=0.3,
+                 breaker=None, image_breaker=None, limiter=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.breaker = breaker
+        self.image_breaker = image_breaker
+        self.limiter = limiter
+        # Timeouts mean a hung TMDB socket can never hold a worker forever
+        self.timeout = (connect_timeout, read_timeout)
+        # Retry a small number of times on connection errors and on TMDB being busy
+        # Backoff waits backoff_factor, then 2x, 4x... between attempts
+        # Retry-After from a 429 is respected
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # Makes a GET request to a TMDB endpoint and returns the response
+    # priority is the call's rate limiter class - "background", "page" or "search"
+    # Raises requests.HTTPError if TMDB still answers with an error after retrying,
+    # breaker.CircuitOpenError without calling TMDB while the circuit is open
+    # and ratelimit.RateLimitedError if the call would have to wait too long for quota
+    def get(self, endpoint, params=None, priority="page"):
+        params = {"api_key": self.api_key, **(params or {})}
+        # Quota first, so a call turned away by the limiter never uses up a half open probe
+        if self.limiter is not None:
+            self.limiter.acquire(priority)
+        return self._get(self.breaker, self.base_url + endpoint, params)
+
+    # Downloads a poster image, such as size "w342" and path "abc123.jpg", and returns its bytes
+    # Uses the same pooled session, timeouts and retries as the API calls
+    def get_image(self, size, path):
+        return self._get(self.image_breaker, f"{TMDB_IMAGE_URL}/{size}/{path}").content
+
+    def _get(self, breaker, url, params=None):
+        if breaker is not None:
+            breaker.allow()
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        except BaseException:
+            if breaker is not None:
+                breaker.record(False, time.monotonic() - started)
+            raise
+        if breaker is not None:
+            breaker.record(is_healthy_status(response.status_code), time.monotonic() - started)
+        response.raise_for_status()
+        return response
+
+    # Closes the pooled connections
+    def close(self):
+        self.session.close()
+
+
+# Async client for the TMDB API, used by the ASGI serving mode (asgi.py)
+# Same pooling, timeouts and retries as TMDBClient, but waiting on TMDB doesn't tie up a thread,
+# so one process can have thousands of requests in flight
+class AsyncTMDBClient:
+    def __init__(self, api_key, base_url=TMDB_BASE_URL, pool_size=100,
+                 connect_timeout=3.05, read_timeout=10, max_retries=2, backoff_factor=0.3, breaker=None,
+                 limiter=None):
+        if httpx is None:
+            raise RuntimeError("httpx is needed for the async TMDB client")
+        self.api_key = api_key
+        self.base_url = base_url
+        # Pass the same breaker and limiter as the sync client so both modes see TMDB the same way
+        self.breaker = breaker
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        # The transport retries failed connections, TMDB being busy is retried in get()
+        transport = httpx.AsyncHTTPTransport(retries=max_retries, limits=limits)
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    # Makes a GET request to a TMDB endpoint and returns the response
+    # Raises httpx.HTTPStatusError if TMDB still answers with an error after retrying
+    # breaker.CircuitOpenError is raised without calling TMDB while the circuit is open
+    # and ratelimit.RateLimitedError if the call would have to wait too long for quota
+    async def get(self, endpoint, params=None, priority="page"):
+        params = {"api_key": self.api_key, **(params or {})}
+        if self.limiter is not None:
+            await self.limiter.acquire_async(priority)
+        if self.breaker is not None:
+            self.breaker.allow()
+        started = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                response = await self.client.get(self.base_url + endpoint, params=params)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                # Respect Retry-After from a 429, otherwise back off the same way urllib3's Retry does
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff_factor * (2 ** attempt)
+                await asyncio.sleep(delay)
+        except BaseException:
+            if self.breaker is not None:
+                self.breaker.record(False, time.monotonic() - started)
+            raise
+        if self.breaker is not None:
+            self.breaker.record(is_healthy_status(response.status_code), time.monotonic() - started)
+        response.raise_for_status()
+        return response
+
+    # Closes the pooled connections
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,31 @@
+# Production entry point
+# Run it with a pre-fork server, such as: gunicorn -c gunicorn.conf.py wsgi:app
+# python app.py still starts the debug server for development
+#
+# With preload_app (see gunicorn.conf.py) the master process imports this file once - the schema is set up
+# and the caches are warmed before any worker starts, and every forked worker begins with a copy of the
+# warm caches instead of answering its first requests cold
+import time
+
+import database
+import migrations
+from app import app, tmdb_cache, tmdb_client, trending_refresher, warm_caches
+from models import db
+
+
+started = time.perf_counter()
+with app.app_context():
+    # Create database tables and apply any schema changes that have not been run yet - once, not per worker
+    migrations.setup_schema(app)
+    # Connections opened here must not be shared with the forked workers
+    db.engine.dispose()
+warmed = warm_caches(app.config["WARM_MOVIE_COUNT"])
+app.logger.info("Warmed the trending list and %s movies in %.1fs", warmed, time.perf_counter() - started)
+
+# Sockets, SQLite connections and threads don't survive a fork safely, so close anything warming opened
+# Each worker opens its own again on first use, and restarts the trending refresh thread lazily
+tmdb_client.close()
+database.close_thread_db()
+if app.config["TMDB_CACHE_BACKEND"] == "sqlite":
+    tmdb_cache.close()
+trending_refresher.stop()